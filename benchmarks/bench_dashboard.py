@@ -0,0 +1,214 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+# run from the repo root, so the dashboard modules & their relative data paths resolve
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+os.chdir(repo_root)
+
+from dash_config import (county_dict, dash_variable_dict, default_county, sub_geos_list,  # noqa: E402
+                         transaction_years, year_built_dict)
+from dash_figures import choropleth_classes, mapper_2D, mapper_3D, plotly_charter  # noqa: E402
+from housing_cube import HousingCube  # noqa: E402
+from query_layer import QueryLayer, normalize_filters  # noqa: E402
+from sales_data import dashboard_columns, load_sales  # noqa: E402
+from timeseries import MonthlyStore  # noqa: E402
+from tract_geometry import level_for_view, load_tract_levels  # noqa: E402
+
+# where benchmark results are saved
+results_path = 'benchmarks/results'
+
+
+# every combination of the sidebar selections, as the raw widget values
+def sidebar_combinations():
+    year_ranges = itertools.combinations_with_replacement(transaction_years, 2)
+    vintage_ranges = list(itertools.combinations_with_replacement(list(year_built_dict), 2))
+    geographies = [('Entire county', '')] + [
+        ('City/Region', list(sub_geos))
+        for n in range(1, len(sub_geos_list) + 1)
+        for sub_geos in itertools.combinations(sub_geos_list, n)
+    ]
+
+    for years, year_built, (geography_included, sub_geo), dash_variable in itertools.product(
+            year_ranges, vintage_ranges, geographies, dash_variable_dict):
+        yield years, year_built, geography_included, sub_geo, dash_variable
+
+
+# scale the sales up by repeating them, with a little noise on the prices so the copies aren't identical
+def scale_sales(df, factor, seed=0):
+    if factor == 1:
+        return df
+
+    rng = np.random.default_rng(seed)
+    scaled = pd.concat([df] * factor, ignore_index=True)
+    noise = rng.lognormal(0, 0.05, len(scaled))
+    scaled['sale_price'] = (scaled['sale_price'] * noise).round().astype(df['sale_price'].dtype)
+    scaled['price_sf'] = (scaled['sale_price'] / scaled['square_feet']).astype(df['price_sf'].dtype)
+    return scaled
+
+
+# the dashboard's stages, each run headlessly for one set of sidebar selections. The query layer's cache is
+# off, but its monthly store keeps every chart series it builds, so the chart stage builds its slice in a
+# fresh store on every call. plotly_charter times only the figure, from the store's kept series
+def stage_functions(queries, geometry, combo):
+    years, year_built, geography_included, sub_geo, dash_variable = combo
+    state = normalize_filters(years, year_built, geography_included, sub_geo, dash_variable)
+
+    def map_2D():
+        df = queries.map_frame(state)
+        breaks = choropleth_classes(queries, df, dash_variable)
+        return mapper_2D(df, geometry, breaks, dash_variable, 'Light').to_json()
+
+    def map_3D():
+        df = queries.map_frame(state)
+        breaks = choropleth_classes(queries, df, dash_variable)
+        return mapper_3D(df, geometry, breaks, dash_variable, 'Light').to_json()
+
+    return {
+        'filter_data_map': lambda: queries.map_frame(state),
+        'filter_data_chart': lambda: MonthlyStore(queries.cube, precompute=False).series(
+            state.year_built, state.sub_geo, state.dash_variable),
+        'kpis': lambda: (queries.kpi_totals(state), queries.kpi_changes(state)),
+        'mapper_2D': map_2D,
+        'mapper_3D': map_3D,
+        'plotly_charter': lambda: plotly_charter(
+            queries.chart_series(state), dash_variable, years, sub_geo).to_json()
+    }
+
+
+# latency of one call in milliseconds
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+# peak memory allocated by one call in megabytes
+def peak_memory(func):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def summarize(latencies, peaks):
+    latencies = np.asarray(latencies)
+    return {
+        'runs': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+        'peak_mb': float(max(peaks))
+    }
+
+
+# run every stage over the sidebar combinations at one data scale
+def bench_scale(base, factor, combos, memory_samples, load_repeats):
+    results = {'rows': len(base) * factor}
+
+    df = scale_sales(base, factor)
+
+    # the load & cube build only happen once per process in the dashboard, so they're timed a few times. The
+    # scaled sales are written to a Feather file first, so the load is timed on a file of the scale's size
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sales.feather')
+        feather.write_feather(df, path, compression='uncompressed')
+        load = lambda: load_sales(dashboard_columns, src=path, path=path)  # noqa: E731
+        results['load_tab_data'] = summarize(
+            [timed(load) for _ in range(load_repeats)], [peak_memory(load)])
+
+    build = lambda: HousingCube(df)  # noqa: E731
+    results['build_cube'] = summarize(
+        [timed(build) for _ in range(load_repeats)], [peak_memory(build)])
+
+    queries = QueryLayer(HousingCube(df), max_entries=0)
+
+    # build the chart store's series up front, so plotly_charter's first call doesn't include them
+    queries.monthly
+    # the tract geometry at the level of detail the dashboard sends for its 2D view
+    geometry = level_for_view(load_tract_levels(), county_dict[default_county]['view_2D'])
+
+    latencies = {}
+    peaks = {}
+    for i, combo in enumerate(combos):
+        for stage, func in stage_functions(queries, geometry, combo).items():
+            latencies.setdefault(stage, []).append(timed(func))
+
+            # tracemalloc slows everything down, so only a few combinations are measured for memory
+            if i < memory_samples:
+                peaks.setdefault(stage, []).append(peak_memory(func))
+
+    for stage in latencies:
+        results[stage] = summarize(latencies[stage], peaks[stage])
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the dashboard data functions over every sidebar combination.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help='synthetic data scales, as multiples of the current sales')
+    parser.add_argument('--max-combos', type=int, default=0,
+                        help='evenly sample this many sidebar combinations (0 runs all of them)')
+    parser.add_argument('--memory-samples', type=int, default=5,
+                        help='sidebar combinations measured for peak memory per stage')
+    parser.add_argument('--load-repeats', type=int, default=3, help='timed runs of the load & cube build')
+    parser.add_argument('--out', default=None, help='results JSON (defaults to benchmarks/results/)')
+    args = parser.parse_args()
+
+    combos = list(sidebar_combinations())
+    if args.max_combos and args.max_combos < len(combos):
+        combos = [combos[i] for i in np.linspace(0, len(combos) - 1, args.max_combos).astype(int)]
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'combinations': len(combos),
+        'scales': {}
+    }
+
+    base = load_sales(dashboard_columns)
+    for factor in args.scales:
+        print(f'benchmarking {factor}x ({len(base) * factor:,} sales, {len(combos):,} combinations)')
+        report['scales'][f'{factor}x'] = bench_scale(
+            base, factor, combos, args.memory_samples, args.load_repeats)
+
+        for stage, stats in report['scales'][f'{factor}x'].items():
+            if isinstance(stats, dict):
+                print(f"  {stage:<18} p50 {stats['p50_ms']:9.2f} ms   p99 {stats['p99_ms']:9.2f} ms"
+                      f"   peak {stats['peak_mb']:8.1f} MB")
+
+    out = args.out or os.path.join(results_path, f"{report['timestamp'].replace(':', '')}-{commit}.json")
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'saved results to {out}')
@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.websocket import websocket_connect
+
+# run from the repo root, so the dashboard & its relative data paths resolve
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(repo_root)
+
+# where load test results are saved
+results_path = 'benchmarks/results'
+
+# the sidebar widget types a session changes, & the WidgetState field each one sends its value in
+widget_fields = {
+    'radio': 'int_value',
+    'selectbox': 'int_value',
+    'checkbox': 'bool_value',
+    'multiselect': 'int_array_value',
+    'slider': 'double_array_value'
+}
+
+# sidebar delta paths start with the sidebar container
+sidebar_container = 1
+
+
+# start the dashboard on a local port & wait for it to report healthy, checking every interval seconds
+def start_server(port, app='rockdale_dash.py', env=None, interval=0.5):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', app, '--server.headless', 'true',
+         '--server.port', str(port), '--browser.gatherUsageStats', 'false'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://localhost:{port}/_stcore/health', timeout=1) as response:
+                if response.read() == b'ok':
+                    return server
+        except OSError:
+            time.sleep(interval)
+
+    server.kill()
+    raise RuntimeError('the dashboard did not start')
+
+
+# cumulative CPU seconds & resident memory (MB) of a process, read from /proc (Linux only)
+def process_usage(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    with open(f'/proc/{pid}/status') as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS'))
+
+    return cpu, rss / 1024
+
+
+class UsageSampler:
+
+    # sample the server's CPU & memory in a background thread
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append((time.perf_counter(),) + process_usage(self.pid))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.samples.append((time.perf_counter(),) + process_usage(self.pid))
+
+    # CPU use between samples, in cores (1.0 is one core fully busy)
+    def cpu_cores(self):
+        samples = np.array(self.samples)
+        return np.diff(samples[:, 1]) / np.diff(samples[:, 0])
+
+    def rss(self):
+        return np.array(self.samples)[:, 2]
+
+
+class DashboardSession:
+
+    # one browser session, talking to the server over the same websocket protocol as the frontend
+    def __init__(self, url, rng):
+        self.url = url
+        self.rng = rng
+        self.widgets = {}
+        self.values = {}
+        self.latencies = []
+        self.first_deltas = []
+        self.errors = 0
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url, subprotocols=['streamlit'], max_message_size=2 ** 30)
+
+    def close(self):
+        self.ws.close()
+
+    # send the widget values, then wait for the rerun to finish. Returns the rerun latency in ms
+    async def rerun(self):
+        msg = BackMsg()
+        msg.rerun_script.SetInParent()
+        for widget_id, (kind, value) in self.values.items():
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = widget_id
+            field = widget_fields[kind]
+            if field.endswith('array_value'):
+                getattr(state, field).data.extend(value)
+            else:
+                setattr(state, field, value)
+
+        start = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+
+        # collect the sidebar widgets drawn by this rerun, since some only appear for certain selections
+        widgets = {}
+        first_delta = None
+        while True:
+            payload = await self.ws.read_message()
+            if payload is None:
+                raise ConnectionError('the dashboard closed the connection')
+
+            fwd = ForwardMsg()
+            fwd.ParseFromString(payload)
+            kind = fwd.WhichOneof('type')
+
+            # the first element drawn, i.e. when the page shell starts to appear
+            if kind == 'delta' and first_delta is None:
+                first_delta = (time.perf_counter() - start) * 1000
+
+            if kind == 'delta' and fwd.delta.WhichOneof('type') == 'new_element':
+                element = fwd.delta.new_element
+                element_kind = element.WhichOneof('type')
+                if element_kind == 'exception':
+                    self.errors += 1
+                elif element_kind in widget_fields and fwd.metadata.delta_path[0] == sidebar_container:
+                    widgets[getattr(element, element_kind).id] = (element_kind, getattr(element, element_kind))
+
+            elif kind == 'script_finished':
+                if fwd.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue
+                if fwd.script_finished != ForwardMsg.FINISHED_SUCCESSFULLY:
+                    self.errors += 1
+                break
+
+        latency = (time.perf_counter() - start) * 1000
+        self.first_deltas.append(first_delta)
+        self.widgets = widgets
+        self.values = {widget_id: value for widget_id, value in self.values.items() if widget_id in widgets}
+        return latency
+
+    # change one sidebar widget at random, the way a visitor clicks around
+    def change_widget(self):
+        widget_id = self.rng.choice(sorted(self.widgets))
+        kind, widget = self.widgets[widget_id]
+
+        if kind in ('radio', 'selectbox'):
+            value = self.rng.randrange(len(widget.options))
+        elif kind == 'checkbox':
+            value = not self.values.get(widget_id, (kind, widget.default))[1]
+        elif kind == 'multiselect':
+            value = sorted(self.rng.sample(range(len(widget.options)), self.rng.randint(1, len(widget.options))))
+        else:
+            value = sorted(self.rng.choices(range(len(widget.options)), k=len(widget.default)))
+            value = [float(index) for index in value]
+
+        self.values[widget_id] = (kind, value)
+
+    # load the page, then make a number of sidebar changes with a random pause between them
+    async def run(self, reruns, think_seconds):
+        await self.connect()
+        try:
+            self.latencies.append(await self.rerun())
+            for _ in range(reruns):
+                await asyncio.sleep(self.rng.expovariate(1 / think_seconds) if think_seconds else 0)
+                self.change_widget()
+                self.latencies.append(await self.rerun())
+        finally:
+            self.close()
+
+
+def summarize(values):
+    values = np.asarray(values)
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max())
+    }
+
+
+# run the sessions concurrently, starting them over the ramp-up period
+async def run_sessions(url, n_sessions, reruns, think_seconds, ramp_seconds, seed):
+    sessions = [DashboardSession(url, random.Random(seed + i)) for i in range(n_sessions)]
+
+    async def start(i, session):
+        await asyncio.sleep(ramp_seconds * i / n_sessions)
+        await session.run(reruns, think_seconds)
+
+    await asyncio.gather(*[start(i, session) for i, session in enumerate(sessions)])
+    return sessions
+
+
+def load_test(port, n_sessions, reruns, think_seconds, ramp_seconds, seed, sample_interval):
+    server = start_server(port)
+    url = f'ws://localhost:{port}/_stcore/stream'
+
+    try:
+        idle_rss = process_usage(server.pid)[1]
+
+        # one session warms the process-wide caches, so what's left after it is shared by every session
+        asyncio.run(run_sessions(url, 1, 0, 0, 0, seed))
+        warm_rss = process_usage(server.pid)[1]
+
+        sampler = UsageSampler(server.pid, sample_interval).start()
+        start = time.perf_counter()
+        sessions = asyncio.run(run_sessions(url, n_sessions, reruns, think_seconds, ramp_seconds, seed))
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [latency for session in sessions for latency in session.latencies]
+    cpu = sampler.cpu_cores()
+    rss = sampler.rss()
+
+    return {
+        'sessions': n_sessions,
+        'reruns': len(latencies),
+        'errors': sum(session.errors for session in sessions),
+        'seconds': elapsed,
+        'reruns_per_second': len(latencies) / elapsed,
+        'latency_ms': summarize(latencies),
+        'cpu_cores': {'mean': float(cpu.mean()), 'max': float(cpu.max())},
+        'memory_mb': {
+            'idle': idle_rss,
+            'shared': warm_rss - idle_rss,
+            'peak': float(rss.max()),
+            'per_session': max(float(rss.max()) - warm_rss, 0) / n_sessions
+        }
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load test the dashboard with concurrent sessions making random sidebar changes.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 5, 10, 25],
+                        help='numbers of concurrent sessions to test, one run each')
+    parser.add_argument('--reruns', type=int, default=20, help='sidebar changes made by each session')
+    parser.add_argument('--think', type=float, default=1.0, help='mean pause between changes, in seconds')
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which the sessions start')
+    parser.add_argument('--port', type=int, default=8599, help='local port for the dashboard server')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the sidebar changes')
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='seconds between CPU & memory samples')
+    parser.add_argument('--out', default=None, help='results JSON (defaults to benchmarks/results/)')
+    args = parser.parse_args()
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'reruns_per_session': args.reruns,
+        'think_seconds': args.think,
+        'runs': []
+    }
+
+    for n_sessions in args.sessions:
+        print(f'load testing {n_sessions} concurrent session(s)')
+        result = load_test(args.port, n_sessions, args.reruns, args.think, args.ramp, args.seed,
+                           args.sample_interval)
+        report['runs'].append(result)
+
+        latency, memory = result['latency_ms'], result['memory_mb']
+        print(f"  {result['reruns']} reruns ({result['errors']} errors), {result['reruns_per_second']:.1f} reruns/s,"
+              f" latency p50 {latency['p50']:.0f} ms p99 {latency['p99']:.0f} ms")
+        print(f"  CPU {result['cpu_cores']['mean']:.2f} cores (max {result['cpu_cores']['max']:.2f}),"
+              f" memory {memory['idle']:.0f} MB idle + {memory['shared']:.0f} MB shared"
+              f" + {memory['per_session']:.1f} MB per session")
+
+    out = args.out or os.path.join(results_path, f"load-{report['timestamp'].replace(':', '')}-{commit}.json")
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'saved results to {out}')
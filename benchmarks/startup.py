@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# run from the repo root, so the dashboard & its relative data paths resolve
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_root, 'benchmarks'))
+os.chdir(repo_root)
+
+from load_test import DashboardSession, git_commit, results_path, start_server  # noqa: E402
+
+# the modules the dashboard script imports before it draws anything
+dashboard_modules = ['streamlit', 'counties', 'dash_config', 'dash_figures', 'hexbins', 'kpis', 'query_layer',
+                     'rerun_profile', 'timeseries']
+
+
+# time importing the dashboard's modules in a fresh interpreter, in ms
+def import_ms():
+    script = (f"import time; start = time.perf_counter(); import {', '.join(dashboard_modules)}; "
+              f"print((time.perf_counter() - start) * 1000)")
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+
+# open the page in a new session & return (first element drawn, page finished) in ms
+async def open_page(url):
+    session = DashboardSession(url, None)
+    await session.connect()
+    try:
+        latency = await session.rerun()
+    finally:
+        session.close()
+
+    if session.errors:
+        raise RuntimeError('the dashboard raised an exception')
+    return session.first_deltas[0], latency
+
+
+# one cold start: launch a new server, open the page, then open it again in a second session
+def cold_start(port, prewarm):
+    env = dict(os.environ, DASH_PREWARM='1' if prewarm else '0')
+
+    start = time.perf_counter()
+    server = start_server(port, env=env, interval=0.05)
+    server_s = time.perf_counter() - start
+
+    try:
+        url = f'ws://localhost:{port}/_stcore/stream'
+        shell_ms, first_ms = asyncio.run(open_page(url))
+        _, warm_ms = asyncio.run(open_page(url))
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {'server_s': server_s, 'shell_ms': shell_ms, 'first_page_ms': first_ms, 'warm_page_ms': warm_ms}
+
+
+def summarize(runs):
+    return {name: float(np.median([run[name] for run in runs])) for name in runs[0]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time the dashboard cold start: imports, server start, first page & a warm page.')
+    parser.add_argument('--repeats', type=int, default=5, help='cold starts to run for each prewarm setting')
+    parser.add_argument('--port', type=int, default=8598, help='local port for the dashboard server')
+    parser.add_argument('--out', default=None, help='results JSON (defaults to benchmarks/results/)')
+    args = parser.parse_args()
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'import_ms': [import_ms() for _ in range(args.repeats)],
+        'runs': {}
+    }
+    print(f"imports: {np.median(report['import_ms']):.0f} ms")
+
+    for prewarm in (True, False):
+        runs = [cold_start(args.port, prewarm) for _ in range(args.repeats)]
+        median = summarize(runs)
+        report['runs']['prewarm' if prewarm else 'no_prewarm'] = {'median': median, 'runs': runs}
+
+        print(f"{'prewarm' if prewarm else 'no prewarm':<11} server {median['server_s']:.2f} s,"
+              f" page shell {median['shell_ms']:.0f} ms, first page {median['first_page_ms']:.0f} ms,"
+              f" warm page {median['warm_page_ms']:.0f} ms")
+
+    out = args.out or os.path.join(results_path, f"startup-{report['timestamp'].replace(':', '')}-{commit}.json")
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'saved results to {out}')
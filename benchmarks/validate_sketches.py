@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# run from the repo root, so the dashboard modules & their relative data paths resolve
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+os.chdir(repo_root)
+
+from bench_dashboard import git_commit, results_path, scale_sales, sidebar_combinations  # noqa: E402
+from housing_cube import HousingCube  # noqa: E402
+from quantile_sketch import SketchCube, sketch_size  # noqa: E402
+from query_layer import QueryLayer, normalize_filters  # noqa: E402
+from sales_data import dashboard_columns, load_sales  # noqa: E402
+
+# the median KPIs & the measures they're taken over
+kpi_medians = {
+    'median_vintage': 'yr_built',
+    'median_sf': 'square_feet',
+    'median_price_sf': 'price_sf',
+    'median_price': 'sale_price'
+}
+
+
+# every exact value of a measure within the selected cells of the cube, sorted
+def selected_values(cube, mask, measure):
+    cells = cube.cells[mask]
+    counts = cells['count'].to_numpy()
+    positions = np.repeat(
+        cells['start'].to_numpy() - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return np.sort(cube.values[measure][positions])
+
+
+# how far the estimate's rank is from the middle, as a fraction of the selected values
+def rank_error(values, estimate):
+    if not len(values):
+        return 0.0
+    below = np.searchsorted(values, estimate, side='left')
+    at_or_below = np.searchsorted(values, estimate, side='right')
+    middle = len(values) / 2
+    return max(0.0, below - middle, middle - at_or_below) / len(values)
+
+
+def relative_errors(exact, sketched):
+    exact, sketched = np.asarray(exact, dtype='float64'), np.asarray(sketched, dtype='float64')
+    keep = ~np.isnan(exact) & (exact != 0)
+    return np.abs(sketched[keep] - exact[keep]) / np.abs(exact[keep])
+
+
+# time the median queries for every combination with both cubes, without the query cache
+def time_queries(queries, states):
+    start = time.perf_counter()
+    for state in states:
+        queries.map_frame(state)
+        queries.chart_series(state)
+        queries.kpi_totals(state)
+    return (time.perf_counter() - start) * 1000 / len(states)
+
+
+# compare the sketched medians with the exact ones over the sidebar combinations
+def validate(df, error, states):
+    exact_cube = HousingCube(df)
+    sketch_cube = SketchCube.from_cube(exact_cube, error)
+    exact = QueryLayer(exact_cube, max_entries=0)
+    sketched = QueryLayer(sketch_cube, max_entries=0)
+
+    errors = {'map': [], 'chart': [], 'kpi': []}
+    ranks = []
+    for state in states:
+        map_exact, map_sketched = exact.map_frame(state), sketched.map_frame(state)
+        chart_exact, chart_sketched = exact.chart_series(state), sketched.chart_series(state)
+        column = map_exact.columns[1]
+        errors['map'].append(relative_errors(map_exact[column], map_sketched[column]))
+        errors['chart'].append(relative_errors(chart_exact, chart_sketched))
+
+        kpi_exact, kpi_sketched = exact.kpi_totals(state), sketched.kpi_totals(state)
+        errors['kpi'].append(relative_errors(kpi_exact[list(kpi_medians)], kpi_sketched[list(kpi_medians)]))
+
+        mask = exact_cube.select(state.years, state.year_built, state.sub_geo)
+        for name, measure in kpi_medians.items():
+            ranks.append(rank_error(selected_values(exact_cube, mask, measure), kpi_sketched[name]))
+
+    report = {
+        'error': error,
+        'points_per_cell': sketch_size(error),
+        'cells_sketched': float((exact_cube.cells['count'] > sketch_size(error)).mean()),
+        'kpi_rank_error_max': float(max(ranks)),
+        'exact_ms': time_queries(exact, states),
+        'sketch_ms': time_queries(sketched, states),
+        'exact_mb': exact_cube.nbytes / 1e6,
+        'sketch_mb': sketch_cube.nbytes / 1e6
+    }
+
+    for output, values in errors.items():
+        values = np.concatenate(values)
+        report[output] = {
+            'values': len(values),
+            'exact_share': float((values == 0).mean()),
+            'mean_relative_error': float(values.mean()),
+            'p99_relative_error': float(np.percentile(values, 99)),
+            'max_relative_error': float(values.max())
+        }
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare the sketched medians with the exact medians on the current sales.')
+    parser.add_argument('--errors', type=float, nargs='+', default=[0.05, 0.01, 0.005],
+                        help='sketch rank errors to validate')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                        help='synthetic data scales, as multiples of the current sales')
+    parser.add_argument('--max-combos', type=int, default=200,
+                        help='evenly sample this many sidebar combinations (0 runs all of them)')
+    parser.add_argument('--out', default=None, help='report JSON (defaults to benchmarks/results/)')
+    args = parser.parse_args()
+
+    combos = list(sidebar_combinations())
+    if args.max_combos and args.max_combos < len(combos):
+        combos = [combos[i] for i in np.linspace(0, len(combos) - 1, args.max_combos).astype(int)]
+    states = list(dict.fromkeys(normalize_filters(*combo) for combo in combos))
+
+    commit = git_commit()
+    report = {'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'runs': []}
+
+    base = load_sales(dashboard_columns)
+    for factor in args.scales:
+        df = scale_sales(base, factor)
+        for error in args.errors:
+            result = validate(df, error, states)
+            result['rows'] = len(df)
+            report['runs'].append(result)
+
+            print(f"{factor}x, error {error}: rank error {result['kpi_rank_error_max']:.4f} (bound {error}),"
+                  f" {result['cells_sketched']:.0%} of cells sketched,"
+                  f" queries {result['exact_ms']:.1f} ms exact / {result['sketch_ms']:.1f} ms sketched,"
+                  f" {result['exact_mb']:.1f} MB exact / {result['sketch_mb']:.1f} MB sketched")
+            for output in ('map', 'chart', 'kpi'):
+                stats = result[output]
+                print(f"  {output:<6} {stats['exact_share']:6.1%} exact,"
+                      f" mean {stats['mean_relative_error']:.4%}, p99 {stats['p99_relative_error']:.4%},"
+                      f" max {stats['max_relative_error']:.4%} relative error")
+
+    out = args.out or os.path.join(results_path, f"sketches-{report['timestamp'].replace(':', '')}-{commit}.json")
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'saved report to {out}')
@@ -0,0 +1,248 @@
+import glob
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from dash_config import county_dict, regional_path
+from hexbins import HexIndex, coordinate_columns
+from housing_cube import HousingCube
+from parcels import ParcelPoints
+from refresh import DatasetRefresher, load_base, partition_patterns
+from repeat_sales import RepeatSalesIndex, parcel_columns
+from sales_data import csv_path, dashboard_columns, feather_path, load_sales, read_partition
+from tract_geometry import level_for_view, load_tract_levels
+
+logger = logging.getLogger(__name__)
+
+# memory the loaded counties may hold together before the least recently used ones are evicted
+memory_budget_mb = 2048
+
+# set DASH_PREWARM=0 to load a county on its first request instead of in the background at startup
+prewarm_enabled = os.environ.get('DASH_PREWARM', '1') != '0'
+
+
+# directory of a county's partition in the regional dataset
+def county_partition(county, regional=regional_path):
+    return os.path.join(regional, f'county={county}')
+
+
+# loader for a county's sales, the files whose modification times trigger a full reload, & the query
+# backend that's built from the loaded sales
+def county_source(county, settings, regional=regional_path):
+    if settings.get('backend', 'pandas') == 'duckdb':
+        from parquet_cube import ParquetCube, parquet_path
+
+        path = settings.get('parquet', parquet_path)
+        return (lambda: path), (path,), ParquetCube
+
+    backend = HousingCube
+    if settings.get('medians') == 'sketch':
+        from quantile_sketch import SketchCube, sketch_error
+
+        error = settings.get('sketch_error', sketch_error)
+        backend = lambda df: SketchCube(df, error)  # noqa: E731
+
+    if settings.get('sales') == 'base':
+        return load_base, (csv_path, feather_path), backend
+
+    partition = settings.get('sales') or county_partition(county, regional)
+    return partition_loader(county, partition, dashboard_columns), (partition,), backend
+
+
+# loader for every file in a county's partition of the regional dataset
+def partition_loader(county, partition, columns):
+    def load_partition():
+        paths = []
+        for pattern in partition_patterns:
+            paths += glob.glob(os.path.join(partition, pattern))
+
+        if not paths:
+            raise FileNotFoundError(f'no sales found for {county} County in {partition}')
+
+        return pd.concat([read_partition(path, columns) for path in sorted(paths)], ignore_index=True)
+
+    return load_partition
+
+
+# the columns of the sales read for the structures built from individual sales: the dashboard's, plus the
+# coordinates & the parcel
+point_columns = dashboard_columns + coordinate_columns + parcel_columns
+
+
+# loader for a county's individual sales, for the hexagon map, the point layer & the repeat-sales index
+# (None if the backend is out-of-core)
+def county_points(county, settings, regional=regional_path):
+    if settings.get('backend', 'pandas') == 'duckdb':
+        return None
+
+    if settings.get('sales') == 'base':
+        return lambda: load_sales(point_columns)
+
+    return partition_loader(county, settings.get('sales') or county_partition(county, regional), point_columns)
+
+
+class CountyData:
+
+    # one county's query layer (kept current by its refresher) & its tract geometry at every level of detail
+    def __init__(self, county, settings, regional=regional_path, poll_seconds=60):
+        self.county = county
+        self.settings = settings
+
+        loader, base_paths, backend = county_source(county, settings, regional)
+        self.refresher = DatasetRefresher(
+            loader,
+            updates=settings.get('updates', os.path.join(county_partition(county, regional), 'Updates')),
+            poll_seconds=poll_seconds,
+            base_paths=base_paths,
+            backend=backend
+        )
+        self.refresher.start()
+
+        self.geometry_levels = load_tract_levels(settings['tracts'])
+        self.geometry_nbytes = sum(len(json.dumps(geometry)) for tolerance, geometry in self.geometry_levels)
+
+        self.points_loader = county_points(county, settings, regional)
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    # a structure built from the individual sales on first use, & rebuilt once the refresher
+    # has loaded a new version (None if the backend is out-of-core)
+    def _from_points(self, name, build):
+        if self.points_loader is None:
+            return None
+
+        version = (self.refresher.version, self.refresher.base_stamp, frozenset(self.refresher.loaded))
+        with self._derived_lock:
+            if name not in self._derived or self._derived[name][0] != version:
+                df = self.points_loader()
+                if self.refresher.loaded:
+                    partitions = [read_partition(path, point_columns) for path in sorted(self.refresher.loaded)]
+                    df = pd.concat([df] + partitions, ignore_index=True)
+
+                self._derived[name] = (version, build(df))
+
+            return self._derived[name][1]
+
+    # the hexagon index for the hexagon map
+    @property
+    def hexbins(self):
+        view = self.settings['view_2D']
+        return self._from_points('hexbins', lambda df: HexIndex(df, (view['latitude'], view['longitude'])))
+
+    # the individual sales for the point layer
+    @property
+    def parcels(self):
+        return self._from_points('parcels', ParcelPoints)
+
+    # the repeat-sales price index for the trend chart
+    @property
+    def repeat_sales(self):
+        return self._from_points('repeat_sales', RepeatSalesIndex)
+
+    # the tract geometry simplified for the map's view, as {GEOID: GeoJSON geometry}
+    def geometry(self, view):
+        return level_for_view(self.geometry_levels, view)
+
+    @property
+    def queries(self):
+        return self.refresher.queries
+
+    # approximate memory held by the county: the cube, plus the serialized size of its geometry levels
+    @property
+    def nbytes(self):
+        derived_nbytes = sum(derived.nbytes for version, derived in self._derived.values())
+        return self.queries.cube.nbytes + self.geometry_nbytes + derived_nbytes
+
+    def close(self):
+        self.refresher.stop()
+
+
+class CountyEngine:
+
+    # serve any configured county from one process. Counties are loaded on their first request &
+    # the least recently used ones are dropped once the loaded counties go over the memory budget
+    def __init__(self, counties=county_dict, budget_mb=memory_budget_mb, regional=regional_path,
+                 poll_seconds=60):
+        self.counties = counties
+        self.budget = budget_mb * 1e6
+        self.regional = regional
+        self.poll_seconds = poll_seconds
+        self._loaded = OrderedDict()
+        self._loading = {}
+        self._warming = set()
+        self._lock = threading.Lock()
+
+    def get(self, county):
+        if county not in self.counties:
+            raise KeyError(f'{county} County is not configured')
+
+        with self._lock:
+            if county in self._loaded:
+                self._loaded.move_to_end(county)
+                return self._loaded[county]
+
+            # one lock per county, so a slow first load doesn't hold up requests for other counties
+            loading = self._loading.setdefault(county, threading.Lock())
+
+        with loading:
+
+            # another session may have loaded the county while this one waited
+            with self._lock:
+                if county in self._loaded:
+                    self._loaded.move_to_end(county)
+                    return self._loaded[county]
+
+            data = CountyData(county, self.counties[county], self.regional, self.poll_seconds)
+            logger.info('loaded %s County (%.1f MB)', county, data.nbytes / 1e6)
+
+            with self._lock:
+                self._loaded[county] = data
+                self._evict()
+
+        return data
+
+    # load counties & build their chart series in a background thread, so a new replica can draw the page
+    # shell while the data loads. A request for a county that's still warming waits on the same load
+    def prewarm(self, counties):
+        with self._lock:
+            counties = [county for county in counties
+                        if county in self.counties and county not in self._loaded and county not in self._warming]
+            self._warming.update(counties)
+
+        if not counties:
+            return None
+
+        def warm():
+            for county in counties:
+                try:
+                    self.get(county).queries.monthly
+                except Exception:
+                    logger.exception('could not prewarm %s County', county)
+                finally:
+                    with self._lock:
+                        self._warming.discard(county)
+
+        thread = threading.Thread(target=warm, name='county-prewarm', daemon=True)
+        thread.start()
+        return thread
+
+    # drop the least recently used counties until the rest fit the budget, always keeping the newest.
+    # Sessions still holding an evicted county's query layer finish their rerun on it
+    def _evict(self):
+        while len(self._loaded) > 1 and self.nbytes > self.budget:
+            county, data = self._loaded.popitem(last=False)
+            data.close()
+            logger.info('evicted %s County', county)
+
+    @property
+    def nbytes(self):
+        return sum(data.nbytes for data in self._loaded.values())
+
+    # the counties currently in memory, least recently used first
+    def loaded(self):
+        with self._lock:
+            return list(self._loaded)
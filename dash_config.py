@@ -0,0 +1,57 @@
+# shared data definitions for the dashboard and the modules that precompute its data
+
+# transaction years offered by the sidebar slider
+transaction_years = [
+    2018,
+    2019,
+    2020,
+    2021,
+    2022,
+    2023
+]
+
+# sub-geography options
+sub_geos_list = [
+    'Conyers',
+    'North Rockdale',
+    'South Rockdale'
+]
+
+# dictionary for filtering by construction vintage
+year_built_dict = {
+    '<2000': [0, 1999],
+    '2000-2010': [2000, 2010],
+    '2011-2023': [2011, 2050]
+}
+
+# dictionary for converting housing dashboard variables into actionable values to be used in the mapping functions
+dash_variable_dict = {
+    'Total sales': ['yr_built', 'count', '{:,.0f}', 'Total sales', ',.0f'],
+    'Price (per SF)': ['price_sf', 'median', '${:.2f}', 'Median price (per SF)', '$.0f'],
+    'Price (overall)': ['sale_price', 'median', '${:,.0f}', 'Median price (overall)', '$,.0f']
+}
+
+# the county served when none is requested
+default_county = 'Rockdale'
+
+# the regional dataset, with one partition directory of joined sales per county (county=<name>/)
+regional_path = 'Data/Regional'
+
+# settings for every county the dashboard can serve. A county's sales are read from its partition of the
+# regional dataset unless 'sales' names another source ('base' is the Rockdale feather / CSV build).
+# 'backend' is 'pandas' (the in-memory cube) or 'duckdb' (scans of the Parquet dataset at 'parquet')
+# With the pandas backend, 'medians': 'sketch' takes medians from per-cell quantile sketches, within
+# 'sketch_error' (a fraction of the sales selected) ranks of the exact median
+county_dict = {
+    'Rockdale': {
+        'backend': 'pandas',
+        'sales': 'base',
+        'tracts': 'Geography/Rockdale_CTs.gpkg',
+        'updates': 'Geocode/Updates',
+        'sub_geos': sub_geos_list,
+        'transaction_years': transaction_years,
+        'view_2D': {'latitude': 33.66, 'longitude': -84.035, 'zoom': 10},
+        'view_3D': {'latitude': 33.64, 'longitude': -84.06, 'zoom': 10.4},
+        'data_date': 'September 15, 2023'
+    }
+}
@@ -0,0 +1,411 @@
+import pandas as pd
+
+from dash_config import county_dict, dash_variable_dict, default_county
+from formatting import class_colors, equal_interval_breaks, format_values
+from tract_geometry import tract_layer_data
+
+# pydeck & plotly are imported inside the functions that draw with them, so a cold start can render the page
+# shell before paying for either import
+
+# global variables for the pydeck chropleth map (each county's initial views are in dash_config.county_dict)
+min_zoom = 8
+max_zoom = 15
+map_height = 575
+
+# set choropleth colors for the map
+custom_colors = [
+    '#97a3ab',  # lightest blue
+    '#667883',
+    '#37505d',
+    '#022b3a'  # darkest blue
+]
+
+# convert the above hex list to RGB values
+custom_colors = [tuple(int(h.lstrip('#')[i:i+2], 16)
+                       for i in (0, 2, 4)) for h in custom_colors]
+
+# colors for the individual sales drawn over the map, from lowest to highest price per SF
+point_colors = [
+    (255, 214, 199),
+    (255, 170, 140),
+    (255, 137, 102),  # matches the chart's year lines
+    (204, 85, 51)
+]
+
+# how the median price choropleths are classified: 'equal' recomputes equal-interval breaks for every
+# selection, while 'quantile' or 'jenks' breaks are computed once over the full dataset so colors stay put
+# when the filters change. Total sales always use equal-interval breaks, since counts grow with the years selected
+choropleth_breaks = 'equal'
+
+# dictionary to change the basemap
+base_map_dict = {
+    'Streets': 'road',
+    'Satellite': 'satellite',
+    'Light': 'light',
+    'Dark': 'dark'
+}
+
+
+# choropleth class breaks for the map data
+def choropleth_classes(queries, df, dash_variable):
+    if dash_variable_dict[dash_variable][1] == 'median' and choropleth_breaks != 'equal':
+        return queries.class_breaks(dash_variable, choropleth_breaks, len(custom_colors))
+
+    return equal_interval_breaks(df[dash_variable_dict[dash_variable][0]], len(custom_colors))
+
+
+# scatter layer of individual sales (see parcels.py), drawn over the tracts or hexagons
+def parcel_layer(points):
+    import pydeck as pdk
+
+    return pdk.Layer(
+        "ScatterplotLayer",
+        points,
+        pickable=False,
+        opacity=0.8,
+        stroked=False,
+        get_position='p',
+        get_fill_color='c',
+        get_radius=20,
+        radius_min_pixels=1.5,
+        radius_max_pixels=6
+    )
+
+
+# function to display 2D map, from the map data grouped by GEOID & the tract geometry. view sets the
+# county's map center & zoom ({'latitude', 'longitude', 'zoom'}), defaulting to Rockdale's, & points
+# adds a layer of individual sales on top
+def mapper_2D(df, geometry, breaks, dash_variable, base_map, view=None, points=None):
+    import pydeck as pdk
+
+    view = view or county_dict[default_county]['view_2D']
+
+    # tabular data
+    df['GEOID'] = df['GEOID'].astype(str)
+
+    # format the proper column
+    df['var_formatted'] = format_values(
+        df[dash_variable_dict[dash_variable][0]], dash_variable_dict[dash_variable][2])
+
+    # create a 'label' column for the above variable
+    df['dashboard_var_label'] = dash_variable_dict[dash_variable][3]
+
+    # set choropleth color
+    df['choro_color'] = class_colors(
+        df[dash_variable_dict[dash_variable][0]], breaks, custom_colors)
+
+    # attach the cached tract geometry to the attribute table
+    layer_data = tract_layer_data(geometry, df)
+
+    # create map intitial state
+    initial_view_state = pdk.ViewState(
+        latitude=view['latitude'],
+        longitude=view['longitude'],
+        zoom=view['zoom'],
+        max_zoom=max_zoom,
+        min_zoom=min_zoom,
+        pitch=0,
+        bearing=0,
+        height=map_height
+    )
+
+    # create the geojson layer which will be rendered
+    geojson = pdk.Layer(
+        "GeoJsonLayer",
+        layer_data,
+        pickable=True,
+        autoHighlight=True,
+        highlight_color=[255, 255, 255, 128],
+        opacity=0.5,
+        stroked=True,
+        filled=True,
+        get_fill_color='choro_color',
+        get_line_color=[255, 255, 255, 50],
+        line_width_min_pixels=1
+    )
+
+    # configure & customize the tooltip
+    tooltip = {
+        "html": "{dashboard_var_label}: <b>{var_formatted}</b><hr style='margin: 10px auto; opacity:0.5; border-top: 2px solid white; width:85%'>\
+                    Census Tract {GEOID} <br>\
+                    {Sub_geo}",
+        "style": {"background": "rgba(2,43,58,0.7)",
+                  "border": "1px solid white",
+                  "color": "white",
+                  "font-family": "Helvetica",
+                  "text-align": "center"
+                  },
+    }
+
+    # instantiate the map object to be rendered to the Streamlit dashboard
+    r = pdk.Deck(
+        layers=[geojson] if points is None else [geojson, parcel_layer(points)],
+        initial_view_state=initial_view_state,
+        map_provider='mapbox',
+        map_style=base_map_dict[base_map],
+        tooltip=tooltip
+    )
+
+    return r
+
+
+# function to display 3D map, from the map data grouped by GEOID & the tract geometry
+def mapper_3D(df, geometry, breaks, dash_variable, base_map, view=None, points=None):
+    import pydeck as pdk
+
+    view = view or county_dict[default_county]['view_3D']
+
+    # tabular data
+    df['GEOID'] = df['GEOID'].astype(str)
+
+    # format the proper column
+    df['var_formatted'] = format_values(
+        df[dash_variable_dict[dash_variable][0]], dash_variable_dict[dash_variable][2])
+
+    # create a 'label' column
+    df['dashboard_var_label'] = dash_variable
+
+    # set choropleth color
+    df['choro_color'] = class_colors(
+        df[dash_variable_dict[dash_variable][0]], breaks, custom_colors)
+
+    # attach the cached tract geometry to the attribute table
+    layer_data = tract_layer_data(geometry, df)
+
+    # create map intitial state
+    initial_view_state = pdk.ViewState(
+        latitude=view['latitude'],
+        longitude=view['longitude'],
+        zoom=view['zoom'],
+        max_zoom=max_zoom,
+        min_zoom=min_zoom,
+        pitch=45,
+        bearing=0,
+        height=map_height
+    )
+
+    # create geojson layer
+    geojson = pdk.Layer(
+        "GeoJsonLayer",
+        layer_data,
+        pickable=True,
+        autoHighlight=True,
+        highlight_color=[255, 255, 255, 90],
+        opacity=0.5,
+        stroked=False,
+        filled=True,
+        wireframe=False,
+        extruded=True,
+        get_elevation='yr_built * 25',
+        get_fill_color='choro_color',
+        get_line_color='choro_color',
+        line_width_min_pixels=1
+    )
+
+    tooltip = {
+        "html": "Median {dashboard_var_label}: <b>{var_formatted}</b><br>Total sales: <b>{yr_built}</b><hr style='margin: 10px auto; opacity:0.5; border-top: 2px solid white; width:85%'>\
+                    Census Tract {GEOID} <br>\
+                    {Sub_geo}",
+        "style": {"background": "rgba(2,43,58,0.7)",
+                  "border": "1px solid white",
+                  "color": "white",
+                  "font-family": "Helvetica",
+                  "text-align": "center"
+                  },
+    }
+
+    r = pdk.Deck(
+        layers=[geojson] if points is None else [geojson, parcel_layer(points)],
+        initial_view_state=initial_view_state,
+        map_provider='mapbox',
+        map_style=base_map_dict[base_map],
+        tooltip=tooltip)
+
+    return r
+
+
+# function to display the hexagon map, from the map data grouped by hexagon (see hexbins.py). Each hexagon
+# is drawn as a six-sided column at its center, so only the aggregated cells are sent to the browser
+def mapper_hex(df, size, breaks, dash_variable, base_map, view=None, extruded=False, points=None):
+    import pydeck as pdk
+
+    view = view or county_dict[default_county]['view_2D']
+
+    # format the proper column
+    df['var_formatted'] = format_values(
+        df[dash_variable_dict[dash_variable][0]], dash_variable_dict[dash_variable][2])
+
+    # create a 'label' column for the above variable
+    df['dashboard_var_label'] = dash_variable_dict[dash_variable][3]
+
+    # set choropleth color
+    df['choro_color'] = class_colors(
+        df[dash_variable_dict[dash_variable][0]], breaks, custom_colors)
+
+    layer_data = df[['long', 'lat', 'yr_built', 'Sub_geo', 'var_formatted', 'dashboard_var_label',
+                     'choro_color']].to_dict(orient='records')
+
+    # create map intitial state
+    initial_view_state = pdk.ViewState(
+        latitude=view['latitude'],
+        longitude=view['longitude'],
+        zoom=view['zoom'],
+        max_zoom=max_zoom,
+        min_zoom=min_zoom,
+        pitch=45 if extruded else 0,
+        bearing=0,
+        height=map_height
+    )
+
+    # create the hexagon layer, leaving a small gap between neighboring hexagons. A six-sided column is drawn
+    # flat-top, so it's turned 90 degrees to match the pointy-top grid the sales are binned on
+    hexagons = pdk.Layer(
+        "ColumnLayer",
+        layer_data,
+        pickable=True,
+        auto_highlight=True,
+        highlight_color=[255, 255, 255, 128],
+        opacity=0.5,
+        disk_resolution=6,
+        angle=90,
+        radius=size,
+        coverage=0.95,
+        extruded=extruded,
+        elevation_scale=25 if extruded else 0,
+        get_position=['long', 'lat'],
+        get_elevation='yr_built',
+        get_fill_color='choro_color'
+    )
+
+    tooltip = {
+        "html": "{dashboard_var_label}: <b>{var_formatted}</b><br>Total sales: <b>{yr_built}</b><hr style='margin: 10px auto; opacity:0.5; border-top: 2px solid white; width:85%'>\
+                    {Sub_geo}",
+        "style": {"background": "rgba(2,43,58,0.7)",
+                  "border": "1px solid white",
+                  "color": "white",
+                  "font-family": "Helvetica",
+                  "text-align": "center"
+                  },
+    }
+
+    r = pdk.Deck(
+        layers=[hexagons] if points is None else [hexagons, parcel_layer(points)],
+        initial_view_state=initial_view_state,
+        map_provider='mapbox',
+        map_style=base_map_dict[base_map],
+        tooltip=tooltip)
+
+    return r
+
+
+# draw the line chart from the monthly series, with its rolling average on top when one is given
+def plotly_charter(series, dash_variable, years, sub_geo, smoothed=None, window=None, repeat_index=None):
+    import plotly.graph_objects as go
+
+    # plot each month at its first day, straight from the numeric arrays
+    months = series.index.to_timestamp()
+
+    fig = go.Figure(go.Scatter(
+        x=months,
+        y=series.to_numpy(),
+        name='Monthly',
+        line_color='#022B3A' if smoothed is None else 'rgba(2, 43, 58, 0.35)'
+    ))
+
+    if smoothed is not None:
+        fig.add_trace(go.Scatter(
+            x=months,
+            y=smoothed.to_numpy(),
+            name=f'{window}-month average',
+            line_color='#022B3A'
+        ))
+
+    # the repeat-sales index (100 at its first period) scaled to the median's average level, so both share
+    # the price axis
+    if repeat_index is not None:
+        fig.add_trace(go.Scatter(
+            x=repeat_index.index.to_timestamp(),
+            y=repeat_index.to_numpy() * series.mean() / repeat_index.mean(),
+            name='Repeat-sales index',
+            line_color='#1F7A8C',
+            line_dash='dot'
+        ))
+
+    # modify the line itself. Months without a median are skipped over, as they were without the store
+    fig.update_traces(
+        mode="lines",
+        connectgaps=True,
+        showlegend=False,
+        hovertemplate="<br>".join([
+            "<b>%{y}</b>"
+        ])
+    )
+
+    # set chart title style variables
+    chart_title_font_size = '20'
+    chart_title_color = '#FFFFFF'
+    chart_title_font_weight = '650'
+
+    chart_subtitle_font_size = '14'
+    chart_subtitle_color = '#FFFFFF'
+    chart_subtitle_font_weight = '650'
+
+    if sub_geo == "":
+        chart_title_text = f"Countywide {dash_variable_dict[dash_variable][3].lower()}"
+    elif len(sub_geo) == 1:
+        chart_title_text = f"{sub_geo[0]} {dash_variable_dict[dash_variable][3].lower()}"
+    elif len(sub_geo) == 2:
+        chart_title_text = f"{sub_geo[0]} & {sub_geo[1]} {dash_variable_dict[dash_variable][3].lower()}"
+    else:
+        chart_title_text = f"{dash_variable_dict[dash_variable][3]} For Selected Regions"
+
+    chart_subtitle_text = '(orange lines reflect range of selected years)'
+    if repeat_index is not None:
+        chart_subtitle_text = '(orange lines reflect range of selected years, dotted line the repeat-sales index)'
+
+    # update the fig
+    fig.update_layout(
+        title_text=f'<span style="font-size:{chart_title_font_size}px; font-weight:{chart_title_font_weight}; color:{chart_title_color}">{chart_title_text}</span><br><span style="font-size:{chart_subtitle_font_size}px; font-weight:{chart_subtitle_font_weight}; color:{chart_subtitle_color}">{chart_subtitle_text}</span>',
+        title_x=0,
+        title_y=0.93,
+        margin=dict(
+            t=85
+        ),
+        hoverlabel=dict(
+            bgcolor="rgba(255, 255, 255, 0.8)",
+            bordercolor="#022B3A",
+            font_size=16,  # set the font size of the chart tooltip
+            font_color="#022B3A",
+            align="left"
+        ),
+        yaxis=dict(
+            linecolor="#022B3A",
+            title=None,
+            tickfont_color='#022B3A',
+            tickfont_size=13,
+            tickformat=dash_variable_dict[dash_variable][4],
+            showgrid=False,
+            zeroline=False
+        ),
+        xaxis=dict(
+            linecolor="#022B3A",
+            linewidth=1,
+            tickfont_color='#022B3A',
+            title=None,
+            tickangle=90,
+            tickfont_size=13,
+            tickformat='%b %Y',
+            dtick='M6'
+        ),
+        height=450,
+        hovermode="x unified")
+
+    # add shifting vertical lines, from the start of the first selected year to the last month of the
+    # last one that has sales
+    last_month = min(pd.Period(year=years[1], month=12, freq='M'), series.index[-1])
+    fig.add_vline(x=f'{years[0]}-01-01', line_width=2,
+                  line_dash="dash", line_color="#FF8966")
+    fig.add_vline(x=last_month.to_timestamp().strftime('%Y-%m-%d'), line_width=2,
+                  line_dash="dash", line_color="#FF8966")
+
+    return fig
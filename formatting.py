@@ -0,0 +1,136 @@
+import re
+
+import numpy as np
+
+# class index of the values that fall in no class (NaN)
+no_class = -1
+
+# matches the format strings in dash_variable_dict, e.g. '${:,.0f}' -> ('$', ',', '0', '')
+format_pattern = re.compile(r'^(.*)\{:(,?)\.(\d+)f\}(.*)$')
+
+
+# format every value with one of the dash_variable_dict format strings, using array string operations
+# instead of one Python format call per row. Matches str.format, e.g. '${:,.2f}'.format(-1234.5) == '$-1,234.50'
+def format_values(values, fmt):
+    match = format_pattern.match(fmt)
+    if match is None:
+        raise ValueError(f'Unsupported format string: {fmt}')
+
+    prefix, thousands, decimals, suffix = match.groups()
+    values = np.asarray(values, dtype='float64')
+    if not len(values):
+        return np.array([], dtype=str)
+
+    # printf-style formatting rounds exactly like str.format does
+    text = np.char.mod(f'%.{decimals}f', np.abs(values))
+
+    if thousands:
+        parts = np.char.partition(text, '.')
+        whole = parts[:, 0]
+
+        # right-justify the whole numbers to a multiple of 3 characters, split them into groups of 3
+        # & join the groups back together with commas
+        width = -(-int(np.char.str_len(whole).max()) // 3) * 3
+        groups = np.char.rjust(whole, width).view('U3').reshape(len(whole), width // 3)
+        grouped = groups[:, 0]
+        for i in range(1, groups.shape[1]):
+            grouped = np.char.add(np.char.add(grouped, ','), groups[:, i])
+
+        # drop the padding along with the commas between empty groups
+        text = np.char.add(np.char.lstrip(grouped, ' ,'), np.char.add(parts[:, 1], parts[:, 2]))
+
+    # the sign goes after any literal prefix, as it does with str.format
+    sign = np.where(np.signbit(values) & ~np.isnan(values), '-', '')
+
+    return np.char.add(np.char.add(prefix, np.char.add(sign, text)), suffix)
+
+
+# equal-interval class breaks over the given values, matching the bins pd.cut would use
+def equal_interval_breaks(values, n_classes):
+    values = np.asarray(values, dtype='float64')
+    if not len(values):
+        return np.zeros(n_classes + 1)
+
+    low, high = np.nanmin(values), np.nanmax(values)
+
+    # pd.cut widens a zero-width range by 0.1% on either side, or by 0.001 when it's at zero
+    if low == high:
+        low, high = (low - 0.001 * abs(low), high + 0.001 * abs(high)) if low != 0 else (-0.001, 0.001)
+
+    return np.linspace(low, high, n_classes + 1)
+
+
+# quantile class breaks, i.e. an equal number of values in every class
+def quantile_breaks(values, n_classes):
+    values = np.asarray(values, dtype='float64')
+    return np.nanquantile(values, np.linspace(0, 1, n_classes + 1))
+
+
+# Jenks natural breaks, which minimize the variance within each class. Large inputs are reduced
+# to evenly spaced quantiles first, which keeps the O(n^2) search fast
+def jenks_breaks(values, n_classes, max_values=1000):
+    values = np.sort(np.asarray(values, dtype='float64')[~np.isnan(values)])
+    if len(values) > max_values:
+        values = np.quantile(values, np.linspace(0, 1, max_values))
+
+    n = len(values)
+    if n <= n_classes:
+        return quantile_breaks(values, n_classes)
+
+    # running sums give the within-class sum of squared deviations for any class values[i:j]
+    sums = np.concatenate([[0], np.cumsum(values)])
+    squares = np.concatenate([[0], np.cumsum(values ** 2)])
+
+    def class_cost(i, j):
+        count = j - i
+        return squares[j] - squares[i] - (sums[j] - sums[i]) ** 2 / count
+
+    # cost[k, j]: lowest total cost of splitting values[:j] into k + 1 classes
+    cost = np.full((n_classes, n + 1), np.inf)
+    split = np.zeros((n_classes, n + 1), dtype=int)
+    ends = np.arange(1, n + 1)
+    cost[0, 1:] = class_cost(0, ends)
+
+    for k in range(1, n_classes):
+        for j in range(k + 1, n + 1):
+            starts = np.arange(k, j)
+            totals = cost[k - 1, starts] + class_cost(starts, j)
+            best = np.argmin(totals)
+            cost[k, j] = totals[best]
+            split[k, j] = starts[best]
+
+    # walk the splits back from the last class
+    breaks = [values[-1]]
+    j = n
+    for k in range(n_classes - 1, 0, -1):
+        j = split[k, j]
+        breaks.append(values[j - 1])
+    breaks.append(values[0])
+
+    return np.array(breaks[::-1])
+
+
+# dictionary of the class break methods
+break_methods = {
+    'equal': equal_interval_breaks,
+    'quantile': quantile_breaks,
+    'jenks': jenks_breaks
+}
+
+
+# map every value to the index of its class, with classes closed on the right like pd.cut.
+# Values outside of the breaks fall into the first or last class, & NaN values get no_class
+def class_index(values, breaks):
+    values = np.asarray(values, dtype='float64')
+    index = np.clip(np.digitize(values, breaks[1:-1], right=True), 0, len(breaks) - 2)
+    return np.where(np.isnan(values), no_class, index)
+
+
+# map every value to an RGB color from the palette (one color per class). Values without a class get
+# None, like the NaN pd.cut gave them
+def class_colors(values, breaks, palette):
+    index = class_index(values, breaks)
+    colors = np.asarray(palette)[index].tolist()
+    for i in np.flatnonzero(index == no_class):
+        colors[i] = None
+    return colors
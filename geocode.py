@@ -0,0 +1,248 @@
+import abc
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+from urllib.parse import unquote
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# the cleaned sales waiting for coordinates, the hand-geocoded sales the tract join reads (& the local
+# provider answers from), where this stage writes its output, & the cache of every address geocoded so far,
+# kept between runs so a refresh only looks up the parcels it hasn't seen
+ready_path = 'Geocode/Rockdale_ready4geocoder.csv'
+geocoded_path = 'Geocode/Rockdale_geocoded.csv'
+output_path = 'Geocode/Rockdale_geocoded_refresh.csv'
+cache_path = 'Geocode/geocode_cache.parquet'
+
+# the columns a cached lookup is keyed on
+cache_keys = ['Parcel ID', 'address_key']
+
+# lookups in flight at once, & lookups between cache writes (so an interrupted run keeps its progress)
+default_concurrency = 8
+default_batch_size = 500
+
+# seconds a single lookup may take before it's counted as failed & retried on the next run
+lookup_timeout = 30
+
+# the spellings of street suffixes & directions that are reduced to the county's abbreviations
+address_abbreviations = {
+    'STREET': 'ST',
+    'DRIVE': 'DR',
+    'ROAD': 'RD',
+    'AVENUE': 'AVE',
+    'BOULEVARD': 'BLVD',
+    'LANE': 'LN',
+    'COURT': 'CT',
+    'CIRCLE': 'CIR',
+    'PLACE': 'PL',
+    'PARKWAY': 'PKWY',
+    'HIGHWAY': 'HWY',
+    'TERRACE': 'TER',
+    'TRAIL': 'TRL',
+    'NORTH': 'N',
+    'SOUTH': 'S',
+    'EAST': 'E',
+    'WEST': 'W',
+    'NORTHEAST': 'NE',
+    'NORTHWEST': 'NW',
+    'SOUTHEAST': 'SE',
+    'SOUTHWEST': 'SW'
+}
+
+abbreviation_pattern = re.compile(r'\b(' + '|'.join(address_abbreviations) + r')\b')
+
+
+# one spelling for every way an address can be written: URL-decoded, upper case, punctuation dropped,
+# single spaces, & suffixes & directions abbreviated (e.g. '2950 Se Landmark Drive.' -> '2950 SE LANDMARK DR')
+def normalize_addresses(addresses):
+    addresses = addresses.fillna('').astype(str).map(unquote).str.upper()
+    addresses = addresses.str.replace(r'[^\w\s-]', ' ', regex=True).str.replace(r'\s+', ' ', regex=True).str.strip()
+    return addresses.str.replace(abbreviation_pattern, lambda m: address_abbreviations[m.group(1)], regex=True)
+
+
+class GeocodeProvider(abc.ABC):
+
+    # a source of coordinates. Subclasses implement geocode(), which looks up one normalized address &
+    # returns (lat, long), or None when the address can't be found. Exceptions (e.g. a network error) mark
+    # the lookup as failed, so it isn't cached & is tried again on the next run
+    name = 'provider'
+
+    # the file the provider reads its answers from, if any, so the output is never written over it
+    source = None
+
+    @abc.abstractmethod
+    async def geocode(self, address):
+        ...
+
+    # release any connections once every batch is done
+    async def close(self):
+        pass
+
+
+class LocalFileProvider(GeocodeProvider):
+
+    # a stand-in provider answering from a file of coordinates that were already collected, e.g. the
+    # hand-geocoded Rockdale_geocoded.csv, for testing the stage without a network service. delay (seconds)
+    # simulates a remote provider's latency
+    name = 'local'
+
+    def __init__(self, path=geocoded_path, address_column='full_address', delay=0):
+        df = pd.read_csv(path, usecols=[address_column, 'lat', 'long'])
+        df = df[df['lat'].notna() & df['long'].notna()]
+        df.index = normalize_addresses(df[address_column])
+
+        self.coordinates = df.loc[~df.index.duplicated(), ['lat', 'long']]
+        self.source = path
+        self.delay = delay
+
+    async def geocode(self, address):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        if address not in self.coordinates.index:
+            return None
+        lat, long = self.coordinates.loc[address]
+        return float(lat), float(long)
+
+
+# providers the command line can pick by name, each built from the --source argument
+geocode_providers = {
+    'local': lambda source: LocalFileProvider(source or geocoded_path)
+}
+
+
+# the cached lookups, or an empty cache on the first run
+def load_cache(path=cache_path):
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    return pd.DataFrame({
+        'Parcel ID': pd.Series(dtype='object'),
+        'address_key': pd.Series(dtype='object'),
+        'lat': pd.Series(dtype='float64'),
+        'long': pd.Series(dtype='float64'),
+        'found': pd.Series(dtype='bool'),
+        'provider': pd.Series(dtype='object'),
+        'geocoded_at': pd.Series(dtype='datetime64[ns]')
+    })
+
+
+# write the cache through a temporary file, so an interrupted write never leaves a broken cache behind
+def save_cache(cache, path=cache_path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    cache.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+# look up a batch of addresses concurrently, at most `concurrency` at a time. Returns one (lat, long),
+# None (not found) or an exception (failed) per address, in the order given
+async def geocode_batch(provider, addresses, concurrency=default_concurrency, timeout=lookup_timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup(address):
+        async with semaphore:
+            return await asyncio.wait_for(provider.geocode(address), timeout)
+
+    return await asyncio.gather(*(lookup(address) for address in addresses), return_exceptions=True)
+
+
+# geocode every (parcel, address) in the keys that isn't cached yet, in batches, adding each batch's
+# results to the cache & saving it before the next. Returns the updated cache & the number of failed lookups
+async def geocode_missing(provider, keys, cache, path=cache_path, concurrency=default_concurrency,
+                          batch_size=default_batch_size):
+    failed = 0
+    try:
+        for start in range(0, len(keys), batch_size):
+            batch = keys.iloc[start:start + batch_size]
+            results = await geocode_batch(provider, batch['query'].tolist(), concurrency)
+
+            found = [result for result in results if not isinstance(result, Exception)]
+            done = np.array([not isinstance(result, Exception) for result in results], dtype=bool)
+            if not done.all():
+                errors = [result for result in results if isinstance(result, Exception)]
+                logger.warning('%d lookups failed, e.g. %r', len(errors), errors[0])
+            failed += int((~done).sum())
+
+            coordinates = np.array([result if result is not None else (np.nan, np.nan) for result in found],
+                                   dtype='float64').reshape(-1, 2)
+            new = pd.DataFrame({
+                'Parcel ID': batch['Parcel ID'].to_numpy()[done],
+                'address_key': batch['address_key'].to_numpy()[done],
+                'lat': coordinates[:, 0],
+                'long': coordinates[:, 1],
+                'found': [result is not None for result in found],
+                'provider': provider.name,
+                'geocoded_at': pd.Timestamp.now()
+            })
+            cache = new if cache.empty else pd.concat([cache, new], ignore_index=True)
+
+            save_cache(cache, path)
+            logger.info('geocoded %d of %d new addresses', min(start + batch_size, len(keys)), len(keys))
+    finally:
+        await provider.close()
+
+    return cache, failed
+
+
+# add lat & long to the sales from the cache, looking up only the parcels & addresses it doesn't hold yet.
+# The provider is sent the normalized full address (street, county & state); sales it can't find are
+# dropped, like the hand-geocoding step left them out
+def geocode_sales(df, provider, path=cache_path, concurrency=default_concurrency, batch_size=default_batch_size):
+    df = df.copy()
+    df['address_key'] = normalize_addresses(df['Address'])
+    query = df['full_address'] if 'full_address' in df else df['Address']
+
+    keys = df[cache_keys].assign(query=normalize_addresses(query)).drop_duplicates(cache_keys)
+    cache = load_cache(path)
+    cached = pd.MultiIndex.from_frame(cache[cache_keys])
+    missing = keys[~pd.MultiIndex.from_frame(keys[cache_keys]).isin(cached)]
+
+    failed = 0
+    if len(missing):
+        cache, failed = asyncio.run(geocode_missing(provider, missing, cache, path, concurrency, batch_size))
+
+    # a parcel re-geocoded under the same address keeps its latest result
+    located = cache[cache['found']].drop_duplicates(cache_keys, keep='last').set_index(cache_keys)[['lat', 'long']]
+    df = df.drop(columns=['lat', 'long'], errors='ignore').join(located, on=cache_keys)
+    df = df[df['lat'].notna()]
+
+    stats = {'sales': len(df), 'cached': len(keys) - len(missing), 'looked_up': len(missing) - failed,
+             'failed': failed}
+    return df.drop(columns='address_key'), stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Geocode the cleaned sales, looking up only the parcels & addresses not cached yet.')
+    parser.add_argument('--src', default=ready_path, help='cleaned sales CSV or Parquet file')
+    parser.add_argument('--dst', default=output_path, help='geocoded output CSV')
+    parser.add_argument('--cache', default=cache_path, help='geocode cache (Parquet)')
+    parser.add_argument('--provider', default='local', choices=list(geocode_providers), help='geocoding provider')
+    parser.add_argument('--source', default=None,
+                        help="the provider's source, e.g. the coordinates file for the local provider")
+    parser.add_argument('--concurrency', type=int, default=default_concurrency, help='lookups in flight at once')
+    parser.add_argument('--batch-size', type=int, default=default_batch_size, help='lookups between cache writes')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
+    # the output has its own schema (e.g. no url column & ISO sale dates), so it must never be written over
+    # the input sales or the file the provider answers from
+    provider = geocode_providers[args.provider](args.source)
+    protected = [path for path in (args.src, provider.source) if path and os.path.exists(path)]
+    if os.path.exists(args.dst) and any(os.path.samefile(args.dst, path) for path in protected):
+        parser.error(f"--dst {args.dst} is the input sales or the provider's source; write the output somewhere else")
+
+    start = time.perf_counter()
+    sales = pd.read_parquet(args.src) if args.src.endswith('.parquet') else pd.read_csv(args.src, index_col=0, dtype={'Parcel ID': str})
+    geocoded, stats = geocode_sales(sales, provider, args.cache, args.concurrency, args.batch_size)
+    geocoded.to_csv(args.dst)
+
+    print(f"geocoded {stats['sales']:,} sales to {args.dst} in {time.perf_counter() - start:.1f} s: "
+          f"{stats['cached']:,} addresses cached, {stats['looked_up']:,} looked up, {stats['failed']:,} failed")
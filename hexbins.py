@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from housing_cube import HousingCube
+from query_layer import QueryLayer
+
+# the coordinate columns kept for the hexagon map
+coordinate_columns = ['lat', 'long']
+
+# hexagon sizes (center to corner, in meters), from coarsest to finest
+hex_resolutions = [4000, 2000, 1000, 500, 250]
+
+# roughly how many pixels across a hexagon should be at the map's zoom level
+hex_target_pixels = 14
+
+earth_radius = 6371008.8
+
+# axial hex keys are packed into one integer: q * key_offset + r, with both shifted to be positive
+key_offset = 2 ** 20
+
+
+# project longitude & latitude onto a flat plane in meters around the origin (lat, long). Within a county,
+# this matches the meter offsets deck.gl uses to draw a column's disk, so the hexagons tile the map
+def to_meters(lon, lat, origin):
+    scale = np.pi / 180 * earth_radius
+    x = (np.asarray(lon, dtype='float64') - origin[1]) * scale * np.cos(np.radians(origin[0]))
+    y = (np.asarray(lat, dtype='float64') - origin[0]) * scale
+    return x, y
+
+
+def to_degrees(x, y, origin):
+    scale = np.pi / 180 * earth_radius
+    lon = origin[1] + x / (scale * np.cos(np.radians(origin[0])))
+    lat = origin[0] + y / scale
+    return lon, lat
+
+
+# key of the pointy-top hexagon of the given size that each point falls in
+def hex_keys(lon, lat, size, origin):
+    x, y = to_meters(lon, lat, origin)
+
+    # fractional axial coordinates, rounded to the nearest hexagon through cube coordinates
+    q = (np.sqrt(3) / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    s = -q - r
+
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+
+    return (rq.astype('int64') + key_offset // 2) * key_offset + (rr.astype('int64') + key_offset // 2)
+
+
+# center longitude & latitude of each hexagon key
+def hex_centers(keys, size, origin):
+    keys = np.asarray(keys, dtype='int64')
+    q = keys // key_offset - key_offset // 2
+    r = keys % key_offset - key_offset // 2
+
+    x = size * np.sqrt(3) * (q + r / 2)
+    y = size * 3 / 2 * r
+    return to_degrees(x, y, origin)
+
+
+# the hexagon size that draws closest to the target width in pixels at a zoom level
+def resolution_for_zoom(zoom, latitude, resolutions=hex_resolutions, target_pixels=hex_target_pixels):
+    meters_per_pixel = 156543.03 * np.cos(np.radians(latitude)) / 2 ** zoom
+    target = target_pixels * meters_per_pixel / np.sqrt(3)
+    return min(resolutions, key=lambda size: abs(np.log(size / target)))
+
+
+# the sub-geography holding most of each hexagon's sales within the selected cells (the cells are keyed by
+# Sub_geo as well as by hexagon, so a sub-geography filter already drops the sales outside of it)
+def hex_sub_geos(cube, mask):
+    sales = cube.cells[mask].groupby(['GEOID', 'Sub_geo'], observed=True)['count'].sum()
+    if sales.empty:
+        return pd.Series(dtype='object')
+    top = sales.sort_values(ascending=False, kind='stable').reset_index().drop_duplicates('GEOID')
+    return top.set_index('GEOID')['Sub_geo']
+
+
+class HexIndex:
+
+    # bin the sales into hexagons at every resolution. Each resolution is its own aggregate cube, with the
+    # hexagon key in place of the tract, so the sidebar filters & rollups work exactly as they do for tracts
+    # & only the aggregated hexagons ever reach the browser
+    def __init__(self, df, origin, resolutions=hex_resolutions, max_entries=512):
+        self.origin = origin
+        self.resolutions = list(resolutions)
+        self.queries = {
+            size: QueryLayer(HousingCube(df.assign(GEOID=hex_keys(df['long'], df['lat'], size, origin))),
+                             max_entries)
+            for size in self.resolutions
+        }
+
+    # map data grouped by hexagon, with each hexagon's center. A hexagon can straddle sub-geographies, so
+    # unlike a tract it has no fixed Sub_geo: it's labeled with the one most of its selected sales fall in
+    def map_frame(self, size, state):
+        queries = self.queries[size]
+        df = queries.map_frame(state)
+        df['long'], df['lat'] = hex_centers(df['GEOID'].astype('int64'), size, self.origin)
+        df['Sub_geo'] = hex_sub_geos(queries.cube, queries.map_mask(state)).reindex(df['GEOID']).to_numpy()
+        return df
+
+    @property
+    def nbytes(self):
+        return sum(queries.cube.nbytes for queries in self.queries.values())
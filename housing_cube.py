@@ -0,0 +1,275 @@
+import numpy as np
+import pandas as pd
+
+from dash_config import year_built_dict
+
+# the dimensions every cube cell is keyed on
+cube_keys = ['year', 'vintage', 'Sub_geo', 'GEOID', 'year-month']
+
+# the measures kept for every cell. Medians can't be added together, so each cell keeps
+# its values as a sorted array & a rollup merges the arrays of the selected cells
+cube_measures = ['price_sf', 'sale_price', 'yr_built', 'square_feet']
+
+
+# assign each sale to one of the construction vintage buckets used by the sidebar slider
+def vintage_bucket(yr_built):
+    lower_bounds = np.array([bounds[0] for bounds in year_built_dict.values()])
+    upper_bounds = np.array([bounds[1] for bounds in year_built_dict.values()])
+
+    # index of the first bucket whose upper bound is at or above the year built
+    codes = np.searchsorted(upper_bounds, np.asarray(yr_built), side='left')
+
+    # sales outside of every bucket can never be selected, so flag them with -1
+    in_range = codes < len(upper_bounds)
+    in_range[in_range] &= np.asarray(yr_built)[in_range] >= lower_bounds[codes[in_range]]
+
+    return np.where(in_range, codes, -1)
+
+
+# convert the (lower, upper) vintage slider values into the range of bucket codes they cover
+def vintage_codes(year_built):
+    buckets = list(year_built_dict)
+    return range(buckets.index(year_built[0]), buckets.index(year_built[1]) + 1)
+
+
+class HousingCube:
+
+    # build the cube once from the tabular sales data
+    def __init__(self, df):
+
+        # tag every sale with its vintage bucket & drop the ones no filter can reach
+        df = df.assign(vintage=vintage_bucket(df['yr_built']))
+        df = df[df['vintage'] >= 0]
+
+        # categorical keys let every rollup group on integer codes
+        df = df.astype({'GEOID': 'category', 'Sub_geo': 'category', 'year-month': 'category'})
+
+        # static lookup tables for the properties fixed by a key: a tract always has one Sub_geo,
+        # & a year-month always has one year, month & monthly period
+        self.geoid_lookup = df[['GEOID', 'Sub_geo']].drop_duplicates(
+            'GEOID').set_index('GEOID')
+        self.month_lookup = df[['year-month', 'year', 'month']].drop_duplicates(
+            'year-month').set_index('year-month')
+        self.month_lookup['period'] = pd.to_datetime(pd.DataFrame({
+            'year': self.month_lookup['year'],
+            'month': self.month_lookup['month'],
+            'day': 1
+        })).dt.to_period('M')
+
+        # number every cell, with cells sorted by their key
+        cell_id = df.groupby(cube_keys, sort=True, observed=True).ngroup().to_numpy()
+
+        # one row per cell, holding the keys & where the cell's values start
+        self.cells = df.groupby(cube_keys, sort=True, observed=True).agg(
+            count=('yr_built', 'size')
+        ).reset_index()
+        self.cells['start'] = np.concatenate(
+            [[0], np.cumsum(self.cells['count'].to_numpy())[:-1]])
+
+        # store each measure ordered by cell, then sorted within the cell
+        self.values = {}
+        for measure in cube_measures:
+            measure_values = df[measure].to_numpy(dtype='float64')
+            order = np.lexsort((measure_values, cell_id))
+            self.values[measure] = measure_values[order]
+
+    # the transaction years in the cube
+    @property
+    def years(self):
+        return self.cells['year'].unique()
+
+    # approximate memory held by the cube, in bytes
+    @property
+    def nbytes(self):
+        return (sum(values.nbytes for values in self.values.values())
+                + int(self.cells.memory_usage(deep=True).sum())
+                + int(self.geoid_lookup.memory_usage(deep=True).sum())
+                + int(self.month_lookup.memory_usage(deep=True).sum()))
+
+    # boolean mask of the cells that fall within the sidebar filters. months is a (first, last) range of
+    # months within each year, e.g. (1, 6) for January through June
+    def select(self, years=None, year_built=None, sub_geo=None, months=None):
+        mask = np.ones(len(self.cells), dtype=bool)
+
+        if years is not None:
+            mask &= self.cells['year'].between(years[0], years[1]).to_numpy()
+
+        if year_built is not None:
+            mask &= self.cells['vintage'].isin(vintage_codes(year_built)).to_numpy()
+
+        # sub_geo is None when the entire county is included
+        if sub_geo is not None:
+            mask &= self.cells['Sub_geo'].isin(sub_geo).to_numpy()
+
+        if months is not None:
+            year_month = self.cells['year-month']
+            month = self.month_lookup['month'].reindex(year_month.cat.categories).to_numpy()[year_month.cat.codes]
+            mask &= (month >= months[0]) & (month <= months[1])
+
+        return mask
+
+    # roll up the selected cells by the given key (or into one row if by is None)
+    # aggs maps each output column to a (column, how) pair, where how is 'count' or 'median'.
+    # Join the lookup tables to the result for the properties fixed by the key
+    def rollup(self, mask, by, aggs):
+        cells = self.cells[mask]
+        counts = cells['count'].to_numpy()
+        categories = None
+
+        # positions of the selected cells' values inside the measure arrays
+        positions = np.repeat(
+            cells['start'].to_numpy() - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        # the key for each of those values
+        if by is None:
+            keys = np.zeros(len(positions), dtype=int)
+            cell_keys = np.zeros(len(cells), dtype=int)
+        else:
+            cell_keys = cells[by]
+
+            # group on the integer codes of categorical keys & map them back afterwards
+            if isinstance(cell_keys.dtype, pd.CategoricalDtype):
+                categories = cell_keys.cat.categories
+                cell_keys = cell_keys.cat.codes
+
+            cell_keys = cell_keys.to_numpy()
+            keys = np.repeat(cell_keys, counts)
+
+        grouped = {}
+        for name, (measure, how) in aggs.items():
+
+            # counts add up, so they can be rolled up without touching the values
+            if how == 'count':
+                grouped[name] = pd.Series(counts).groupby(cell_keys).sum()
+
+            # medians merge the sorted arrays of every cell in the group
+            elif how == 'median':
+                grouped[name] = pd.Series(
+                    self.values[measure][positions]).groupby(keys).median()
+
+            else:
+                raise ValueError(f'Unsupported cube aggregation: {how}')
+
+        grouped_df = pd.DataFrame(grouped)
+
+        if by is None:
+            grouped_df = grouped_df.reindex([0])
+
+            # an empty selection still has a count, it's just zero
+            for name, (measure, how) in aggs.items():
+                if how == 'count':
+                    grouped_df[name] = grouped_df[name].fillna(0).astype(int)
+
+            return grouped_df.iloc[0]
+
+        if categories is not None:
+            grouped_df.index = categories[grouped_df.index]
+
+        grouped_df.index.name = by
+        return grouped_df
+
+    # roll up several selections in one grouped pass over the values of all of them, keyed by the selection
+    # as well as by the given key. Returns one result per mask, the same as rollup(mask, by, aggs) would
+    def rollup_batch(self, masks, by, aggs):
+        masks = list(masks)
+        selected = [np.flatnonzero(mask) for mask in masks]
+        batch = np.repeat(np.arange(len(masks)), [len(cells) for cells in selected])
+        cells = self.cells.iloc[np.concatenate(selected) if masks else []]
+        counts = cells['count'].to_numpy()
+        positions, lengths, weights = self._median_points(cells)
+
+        # number the keys, so each (selection, key) pair gets one integer group
+        if by is None:
+            labels, codes = np.zeros(1, dtype=int), np.zeros(len(cells), dtype='int64')
+        elif isinstance(cells[by].dtype, pd.CategoricalDtype):
+            labels, codes = cells[by].cat.categories, cells[by].cat.codes.to_numpy().astype('int64')
+        else:
+            codes, labels = pd.factorize(cells[by], sort=True)
+        n_labels = max(len(labels), 1)
+        cell_groups = batch * n_labels + codes
+
+        grouped = {}
+        for name, (measure, how) in aggs.items():
+            if how == 'count':
+                grouped[name] = pd.Series(counts).groupby(cell_groups).sum()
+            elif how == 'median':
+                grouped[name] = self._group_medians(measure, positions, np.repeat(cell_groups, lengths), weights)
+            else:
+                raise ValueError(f'Unsupported cube aggregation: {how}')
+
+        grouped_df = pd.DataFrame(grouped, columns=list(aggs))
+        group_batch = grouped_df.index.to_numpy() // n_labels
+
+        results = []
+        for i in range(len(masks)):
+            part = grouped_df[group_batch == i]
+
+            if by is None:
+                part = part.set_axis([0]).reindex([0]) if len(part) else part.reindex([0])
+                for name, (measure, how) in aggs.items():
+                    if how == 'count':
+                        part[name] = part[name].fillna(0).astype(int)
+                results.append(part.iloc[0])
+                continue
+
+            part = part.set_axis(labels[part.index.to_numpy() % n_labels])
+            part.index.name = by
+            results.append(part)
+
+        return results
+
+    # where the selected cells' values sit in the measure arrays, how many each cell has, & each value's
+    # weight (None here, as every value is one sale)
+    def _median_points(self, cells):
+        counts = cells['count'].to_numpy()
+        positions = np.repeat(
+            cells['start'].to_numpy() - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return positions, counts, None
+
+    # the median of the measure's values at the positions, for each group
+    def _group_medians(self, measure, positions, groups, weights):
+        return pd.Series(self.values[measure][positions]).groupby(groups).median()
+
+    # fold new sales into a copy of the cube, leaving this one untouched for the sessions still reading it.
+    # Only the cells the new sales fall in (i.e. the affected months & tracts) are re-sorted; every
+    # other cell's values are copied over as they are
+    def merge(self, df):
+        delta = HousingCube(df)
+
+        # line up the cells of both cubes by key, with the old slice of a cell ahead of the new one
+        cells = pd.concat([
+            self.cells,
+            delta.cells.assign(start=delta.cells['start'] + len(self.values['price_sf']))
+        ], ignore_index=True)
+        cells = cells.astype({'GEOID': 'category', 'Sub_geo': 'category', 'year-month': 'category'})
+        cells = cells.sort_values(cube_keys, kind='stable')
+
+        counts = cells['count'].to_numpy()
+        positions = np.repeat(
+            cells['start'].to_numpy() - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        # the cells found in both cubes are the only ones that need their values merged
+        cell_id = np.repeat(cells.groupby(cube_keys, sort=False, observed=True).ngroup().to_numpy(), counts)
+        affected = np.repeat(cells.duplicated(cube_keys, keep=False).to_numpy(), counts)
+
+        merged = HousingCube.__new__(HousingCube)
+        merged.values = {}
+        for measure in cube_measures:
+            measure_values = np.concatenate([self.values[measure], delta.values[measure]])[positions]
+            resort = measure_values[affected]
+            measure_values[affected] = resort[np.lexsort((resort, cell_id[affected]))]
+            merged.values[measure] = measure_values
+
+        merged.cells = cells.groupby(cube_keys, sort=True, observed=True).agg(
+            count=('count', 'sum')
+        ).reset_index()
+        merged.cells['start'] = np.concatenate(
+            [[0], np.cumsum(merged.cells['count'].to_numpy())[:-1]])
+
+        # the newest sales win if a lookup value ever changes
+        geoid_lookup = pd.concat([self.geoid_lookup, delta.geoid_lookup])
+        merged.geoid_lookup = geoid_lookup[~geoid_lookup.index.duplicated(keep='last')]
+        month_lookup = pd.concat([self.month_lookup, delta.month_lookup])
+        merged.month_lookup = month_lookup[~month_lookup.index.duplicated(keep='last')]
+
+        return merged
@@ -0,0 +1,196 @@
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# the county name used to build the full geocoder address
+county_var = 'Rockdale'
+
+# where the raw county exports live & where the cleaned, partitioned sales are written
+raw_path = 'Data/Raw'
+ingest_path = 'Data/Ingested'
+
+# unique_ID hashes of every sale ingested so far, kept between runs in the output directory
+# (the leading underscore keeps Parquet readers from treating it as a partition file)
+seen_file_name = '_seen_ids.npy'
+
+# prefix & suffix of the partition files written for a chunk that isn't committed yet. Readers skip them:
+# pyarrow ignores files starting with an underscore, & they don't match the *.parquet glob
+pending_prefix = '_'
+pending_suffix = '.pending'
+
+# 0-based positions of the raw export columns that aren't needed
+columns_to_drop = [
+    4,
+    6,
+    7,
+    10,
+    11
+]
+
+# rename columns
+new_column_names = {
+    'Sale Date': 'sale_date',
+    'Sale Price': 'sale_price',
+    'Year  Built ': 'yr_built',
+    'Square Ft ': 'square_feet',
+}
+
+
+# drop the unneeded raw columns & rename the rest
+def select_columns(df):
+    df = df.drop(df.columns[columns_to_drop], axis=1)
+    return df.rename(columns=new_column_names)
+
+
+# change sale_price column to a float, stripping the dollar formatting
+def clean_prices(df):
+    df['sale_price'] = df['sale_price'].astype(str).str.replace(
+        ',', '', regex=False).str.replace('$', '', regex=False).astype(float)
+    return df
+
+
+# create the address, id & price per SF columns
+def add_identifiers(df, county=county_var):
+    df['full_address'] = df['Address'].str.title() + f' {county} County GA'
+    df['unique_ID'] = df['Parcel ID'] + '-' + df['sale_date'] + '-' + df['sale_price'].astype(str)
+    df['price_sf'] = df['sale_price'] / df['square_feet']
+    return df
+
+
+# remove multi-parcel transactions, then drop the 'Reason' column that flags them
+def drop_multi_parcel(df):
+    return df[df['Reason'] != 90].drop('Reason', axis=1)
+
+
+# weed out all sales with a home constructed after the year of sale & add the columns used by the chart
+def add_sale_dates(df):
+    df['sale_date'] = pd.to_datetime(df['sale_date'])
+    df['sale_year'] = df['sale_date'].dt.year
+    df = df[df['yr_built'] <= df['sale_year']].copy()
+
+    df['year'] = df['sale_date'].dt.year
+    df['month'] = df['sale_date'].dt.month
+    df['year-month'] = df['year'].astype(str) + '-' + df['month'].astype(str)
+    return df
+
+
+# drop rows with ridiculously small structures
+def drop_small_homes(df, min_square_feet=500):
+    return df[df['square_feet'] >= min_square_feet]
+
+
+# the cleaning stages, in the order the CSV Concatenator notebook applies them
+def clean_chunk(df, county=county_var):
+    df = select_columns(df)
+    df = clean_prices(df)
+    df = add_identifiers(df, county)
+    df = drop_multi_parcel(df)
+    df = add_sale_dates(df)
+    return drop_small_homes(df)
+
+
+# stable 64-bit hashes of the unique IDs, so the seen set is small & comparable between runs
+def hash_ids(ids):
+    return pd.util.hash_pandas_object(ids, index=False).to_numpy()
+
+
+def load_seen(path):
+    if os.path.exists(path):
+        return np.load(path)
+    return np.array([], dtype='uint64')
+
+
+# write the seen set through a temporary file, so an interrupted write never leaves a broken set behind
+def save_seen(seen, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, seen)
+    os.replace(tmp, path)
+
+
+# keep only the sales not seen before (in this run or an earlier one) & add their hashes to the seen set
+def drop_seen(df, seen):
+    hashes = hash_ids(df['unique_ID'])
+    new = ~np.isin(hashes, seen) & ~pd.Series(hashes).duplicated().to_numpy()
+    return df[new], np.union1d(seen, hashes[new])
+
+
+# where a partition file sits while its chunk is pending
+def pending_path(path):
+    return os.path.join(os.path.dirname(path), pending_prefix + os.path.basename(path) + pending_suffix)
+
+
+# write a cleaned chunk to one Parquet file per sale year partition. The files are written under a pending
+# name that Parquet readers skip & only renamed once the chunk's IDs are saved to the seen set
+def write_partitions(df, out_dir, part_name):
+    paths = []
+    for year, part in df.groupby('year'):
+        partition = os.path.join(out_dir, f'year={year}')
+        os.makedirs(partition, exist_ok=True)
+        path = os.path.join(partition, f'{part_name}.parquet')
+        part.drop('year', axis=1).to_parquet(pending_path(path), index=False)
+        paths.append(path)
+    return paths
+
+
+# publish a chunk's pending partition files
+def publish_partitions(paths):
+    for path in paths:
+        os.replace(pending_path(path), path)
+
+
+# finish the chunk an interrupted run left pending: if its IDs made it into the seen set, the chunk was
+# ingested & only needs publishing, otherwise it's dropped & its sales are read again from the exports
+def recover_pending(out_dir, seen):
+    for pending in glob.glob(os.path.join(out_dir, 'year=*', pending_prefix + '*.parquet' + pending_suffix)):
+        hashes = hash_ids(pd.read_parquet(pending, columns=['unique_ID'])['unique_ID'])
+        if np.isin(hashes, seen).all():
+            name = os.path.basename(pending)[len(pending_prefix):-len(pending_suffix)]
+            os.replace(pending, os.path.join(os.path.dirname(pending), name))
+        else:
+            os.remove(pending)
+
+
+# stream every raw export in chunks through the cleaning stages & into year partitions, so memory is
+# bounded by the chunk size rather than the size of all the exports together
+def ingest(src=raw_path, out_dir=ingest_path, county=county_var, chunksize=100_000):
+    seen_file = os.path.join(out_dir, seen_file_name)
+    run_id = time.strftime('%Y%m%dT%H%M%S')
+    seen = load_seen(seen_file)
+    recover_pending(out_dir, seen)
+    total = 0
+
+    for path in sorted(glob.glob(os.path.join(src, '*.csv'))):
+        stem = os.path.splitext(os.path.basename(path))[0]
+
+        # parcel IDs keep their leading zeros, even in a chunk where every ID happens to look numeric
+        for i, chunk in enumerate(pd.read_csv(path, chunksize=chunksize, dtype={'Parcel ID': str})):
+            chunk, seen = drop_seen(clean_chunk(chunk, county), seen)
+            if not len(chunk):
+                continue
+
+            # the saved seen set is what commits a chunk, so an interrupted run neither loses the chunk
+            # nor ingests it twice
+            paths = write_partitions(chunk, out_dir, f'{run_id}-{stem}-{i:05d}')
+            save_seen(seen, seen_file)
+            publish_partitions(paths)
+            total += len(chunk)
+
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Clean the raw county sales exports into year-partitioned Parquet files.')
+    parser.add_argument('src', nargs='?', default=raw_path, help='directory of raw county CSV exports')
+    parser.add_argument('--out', default=ingest_path, help='output directory for the year partitions')
+    parser.add_argument('--county', default=county_var, help='county name for the geocoder address')
+    parser.add_argument('--chunksize', type=int, default=100_000, help='rows per chunk')
+    args = parser.parse_args()
+
+    total = ingest(args.src, args.out, args.county, args.chunksize)
+    print(f'ingested {total:,} new sales into {args.out}')
@@ -0,0 +1,86 @@
+import calendar
+
+import numpy as np
+import pandas as pd
+
+# the KPIs with a year over year change & how each one is rolled up
+kpi_change_metrics = {
+    'total_sales': ('price_sf', 'count'),
+    'median_price_sf': ('price_sf', 'median'),
+    'median_price': ('sale_price', 'median')
+}
+
+# whether the year-to-date comparison is on when it's offered. Off, so the YoY changes compare full
+# calendar years unless the user asks for year-to-date
+compare_ytd_default = False
+
+
+# the latest year in the cube & the last month it has sales for
+def latest_month(cube):
+    period = cube.month_lookup['period'].max()
+    return period.year, period.month
+
+
+# the (first, last) months of the year-to-date window for comparing every year with the latest one,
+# or None when the latest year is complete & full years already compare like-for-like
+def ytd_months(cube):
+    year, month = latest_month(cube)
+    return None if month == 12 else (1, month)
+
+
+# whether the YoY change between the selected years can be compared year-to-date: only when the selection
+# ends in the latest year & that year is partial. This is when the dashboard offers the checkbox
+def ytd_comparable(cube, years):
+    return years[0] != years[1] and ytd_months(cube) is not None and years[1] == max(cube.years)
+
+
+# short label for a window of months, e.g. (1, 8) -> 'Jan-Aug'
+def months_label(months):
+    return f'{calendar.month_abbr[months[0]]}-{calendar.month_abbr[months[1]]}'
+
+
+# the change KPIs for every transaction year, rolled up in one grouped pass over the selected cells.
+# Years without sales have a count of zero & no medians
+def year_values(cube, year_built, sub_geo, months=None):
+    mask = cube.select(year_built=year_built, sub_geo=sub_geo, months=months)
+    values = cube.rollup(mask, 'year', kpi_change_metrics).reindex(np.sort(cube.years))
+
+    for name, (measure, how) in kpi_change_metrics.items():
+        if how == 'count':
+            values[name] = values[name].fillna(0)
+
+    return values
+
+
+# percent change of every KPI between every pair of years, indexed by (first_year, second_year). A
+# change from zero or from a year without sales is NaN rather than a division by zero
+def change_table(values):
+    years = values.index.to_numpy()
+    first, second = np.triu_indices(len(years), k=1)
+
+    table = values.to_numpy(dtype='float64')
+    before, after = table[first], table[second]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.where(before != 0, after / before - 1, np.nan)
+
+    index = pd.MultiIndex.from_arrays([years[first], years[second]], names=['first_year', 'second_year'])
+    return pd.DataFrame(change, index=index, columns=values.columns)
+
+
+# the YoY change table for the vintage & sub-geography filters. With like_for_like, every year only
+# counts the months the latest (partial) year has sales for, so a partial year isn't compared with full ones
+def kpi_changes(cube, year_built, sub_geo, like_for_like=False):
+    months = ytd_months(cube) if like_for_like else None
+    return change_table(year_values(cube, year_built, sub_geo, months))
+
+
+# look up the change of one KPI between two years, NaN if either year has no sales
+def lookup_change(changes, first_year, second_year, kpi):
+    try:
+        return changes.at[(first_year, second_year), kpi]
+    except KeyError:
+        return np.nan
+
+
+def format_change(change):
+    return 'n/a' if pd.isna(change) else '{:.1%}'.format(change)
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from formatting import class_colors, quantile_breaks
+from housing_cube import vintage_bucket, vintage_codes
+
+# decimal places kept for the point coordinates sent to the browser (5 places is about a meter)
+coordinate_decimals = 5
+
+
+class ParcelPoints:
+
+    # the individual sales for the point layer, held as compact typed arrays that are built once per
+    # dataset version & reused by every rerun. Filters only produce a mask over them
+    def __init__(self, df, max_masks=128):
+        vintage = vintage_bucket(df['yr_built'])
+        keep = vintage >= 0
+
+        self.lon = df['long'].to_numpy(dtype='float32')[keep]
+        self.lat = df['lat'].to_numpy(dtype='float32')[keep]
+        self.price_sf = df['price_sf'].to_numpy(dtype='float32')[keep]
+        self.year = df['year'].to_numpy(dtype='int16')[keep]
+        self.vintage = vintage[keep].astype('int8')
+
+        sub_geo = df['Sub_geo'].astype('category')
+        self.sub_geo_categories = sub_geo.cat.categories
+        self.sub_geo = sub_geo.cat.codes.to_numpy()[keep]
+
+        self.max_masks = max_masks
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    # boolean mask of the sales within the sidebar filters, kept in a small least-recently-used cache
+    def mask(self, state):
+        key = (state.years, state.year_built, state.sub_geo)
+        with self._lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key]
+
+        mask = (self.year >= state.years[0]) & (self.year <= state.years[1])
+        mask &= np.isin(self.vintage, vintage_codes(state.year_built))
+
+        # sub_geo is None when the entire county is included
+        if state.sub_geo is not None:
+            mask &= np.isin(self.sub_geo, self.sub_geo_categories.get_indexer(state.sub_geo))
+
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self.max_masks:
+                self._masks.popitem(last=False)
+
+        return mask
+
+    # compact records for the selected sales: a rounded [long, lat] position & a color by price per SF,
+    # using quantile classes of the selected sales
+    def layer_data(self, state, palette):
+        mask = self.mask(state)
+        if not mask.any():
+            return []
+
+        price_sf = self.price_sf[mask]
+
+        positions = np.round(np.column_stack([self.lon[mask], self.lat[mask]]).astype('float64'),
+                             coordinate_decimals)
+        colors = class_colors(price_sf, quantile_breaks(price_sf, len(palette)), palette)
+
+        return [{'p': position, 'c': color} for position, color in zip(positions.tolist(), colors)]
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.lon, self.lat, self.price_sf, self.year, self.vintage,
+                                              self.sub_geo))
@@ -0,0 +1,179 @@
+import os
+import sys
+import threading
+import uuid
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from dash_config import year_built_dict
+from housing_cube import vintage_codes
+from sales_data import dashboard_columns, load_sales
+
+# the sales history as a Parquet dataset, partitioned by transaction year (year=YYYY/) with each file
+# sorted by GEOID, so a scan can skip whole years & the row groups of unselected tracts
+parquet_path = 'Data/Parquet'
+
+# memory DuckDB may use for a scan before it spills to disk
+memory_limit = '512MB'
+
+
+# write sales into the year partitions, adding new files next to any already there
+def write_sales_parquet(df, dst=parquet_path, row_group_size=64_000):
+    df = df[dashboard_columns].sort_values(['year', 'GEOID'])
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    ds.write_dataset(
+        table,
+        dst,
+        format='parquet',
+        partitioning=['year'],
+        partitioning_flavor='hive',
+        basename_template=f'{uuid.uuid4().hex}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        max_rows_per_group=row_group_size
+    )
+
+
+# build step: convert the dashboard's sales into the Parquet dataset
+def build_sales_parquet(dst=parquet_path):
+    df = load_sales(dashboard_columns)
+    write_sales_parquet(df, dst)
+    return df
+
+
+# SQL predicate for the construction vintages covered by the slider values
+def vintage_predicate(year_built):
+    bounds = list(year_built_dict.values())
+    ranges = [bounds[code] for code in vintage_codes(year_built)]
+    return '(' + ' OR '.join(f'yr_built BETWEEN {lower} AND {upper}' for lower, upper in ranges) + ')'
+
+
+class ParquetCube:
+
+    # an out-of-core stand-in for HousingCube: the same select & rollup calls, run as DuckDB scans over
+    # the Parquet dataset. Only the small lookup tables are held in memory, whatever the size of the history.
+    # pending holds the published sales not yet built into the dataset, which are queried alongside it
+    def __init__(self, path=parquet_path, pending=None):
+        self.path = path
+        self.pending = pending
+        self._db = duckdb.connect(config={'memory_limit': memory_limit})
+        self._local = threading.local()
+
+        columns = ', '.join(f'"{column}"' for column in dashboard_columns)
+        sales = (f"SELECT {columns} FROM read_parquet('{os.path.join(path, '**', '*.parquet')}', "
+                 f"hive_partitioning = true)")
+
+        # the pending sales live in an in-memory table of this connection, which every cursor can read
+        if pending is not None and len(pending):
+            self._db.register('pending_df', pa.Table.from_pandas(pending[dashboard_columns], preserve_index=False))
+            self._db.execute('CREATE TABLE pending AS SELECT * FROM pending_df')
+            self._db.unregister('pending_df')
+            sales += f' UNION ALL BY NAME SELECT {columns} FROM pending'
+
+        # sales outside of every vintage bucket can never be selected, like the cube drops them
+        self.source = (
+            f"(SELECT * FROM ({sales}) "
+            f"WHERE {vintage_predicate((list(year_built_dict)[0], list(year_built_dict)[-1]))})"
+        )
+
+        # static lookup tables, matching the cube's
+        self.geoid_lookup = self._query(
+            f'SELECT GEOID, first(Sub_geo) AS Sub_geo FROM {self.source} GROUP BY GEOID ORDER BY GEOID'
+        ).set_index('GEOID')
+        self.geoid_lookup['Sub_geo'] = self.geoid_lookup['Sub_geo'].astype('category')
+
+        self.month_lookup = self._query(
+            f'SELECT "year-month", first(year) AS year, first(month) AS month FROM {self.source} '
+            f'GROUP BY "year-month" ORDER BY "year-month"'
+        ).astype({'year': 'int16', 'month': 'int16'}).set_index('year-month')
+        self.month_lookup['period'] = pd.to_datetime(pd.DataFrame({
+            'year': self.month_lookup['year'],
+            'month': self.month_lookup['month'],
+            'day': 1
+        })).dt.to_period('M')
+
+        self.years = self.month_lookup['year'].unique()
+
+    # run a query on this thread's own cursor (a DuckDB connection can't be shared between threads)
+    def _query(self, sql):
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._local.cursor = self._db.cursor()
+        return cursor.execute(sql).df()
+
+    # the WHERE clause for the sidebar filters. Sub-geographies are resolved to their tracts, so both
+    # filters prune on the year partitions & GEOID row group statistics
+    def select(self, years=None, year_built=None, sub_geo=None, months=None):
+        predicates = ['TRUE']
+
+        if years is not None:
+            predicates.append(f'year BETWEEN {int(years[0])} AND {int(years[1])}')
+
+        if year_built is not None:
+            predicates.append(vintage_predicate(year_built))
+
+        # sub_geo is None when the entire county is included
+        if sub_geo is not None:
+            geoids = self.geoid_lookup.index[self.geoid_lookup['Sub_geo'].isin(sub_geo)]
+            predicates.append(f"GEOID IN ({', '.join(map(str, geoids)) or 'NULL'})")
+
+        if months is not None:
+            predicates.append(f'month BETWEEN {int(months[0])} AND {int(months[1])}')
+
+        return ' AND '.join(predicates)
+
+    # roll up the selected sales by the given key (or into one row if by is None), with the same
+    # aggs & output as HousingCube.rollup
+    def rollup(self, selection, by, aggs):
+        columns = []
+        for name, (measure, how) in aggs.items():
+            if how == 'count':
+                columns.append(f'count(*) AS "{name}"')
+            elif how == 'median':
+                columns.append(f'median(CAST({measure} AS DOUBLE)) AS "{name}"')
+            else:
+                raise ValueError(f'Unsupported cube aggregation: {how}')
+
+        if by is None:
+            grouped_df = self._query(f'SELECT {", ".join(columns)} FROM {self.source} WHERE {selection}')
+            return grouped_df.astype({
+                name: 'int64' for name, (measure, how) in aggs.items() if how == 'count'}).iloc[0]
+
+        grouped_df = self._query(
+            f'SELECT "{by}", {", ".join(columns)} FROM {self.source} WHERE {selection} '
+            f'GROUP BY "{by}" ORDER BY "{by}"'
+        ).set_index(by)
+
+        for name, (measure, how) in aggs.items():
+            if how == 'count':
+                grouped_df[name] = grouped_df[name].astype('int64')
+
+        return grouped_df
+
+    # each selection is its own scan, since DuckDB already runs every one of them in parallel
+    def rollup_batch(self, selections, by, aggs):
+        return [self.rollup(selection, by, aggs) for selection in selections]
+
+    # return a cube that also reads the new sales. They're held as pending sales rather than written into
+    # the dataset, which only changes when it's rebuilt: the refresher merges every published partition
+    # again on each full load, & a write would also touch the dataset it watches for rebuilds
+    def merge(self, df):
+        pending = df if self.pending is None else pd.concat([self.pending, df], ignore_index=True)
+        return ParquetCube(self.path, pending)
+
+    # memory held in process: the lookup tables & the pending sales
+    @property
+    def nbytes(self):
+        pending_nbytes = 0 if self.pending is None else int(self.pending.memory_usage(deep=True).sum())
+        return (int(self.geoid_lookup.memory_usage(deep=True).sum())
+                + int(self.month_lookup.memory_usage(deep=True).sum()) + pending_nbytes)
+
+
+if __name__ == '__main__':
+    dst = sys.argv[1] if len(sys.argv) > 1 else parquet_path
+
+    df = build_sales_parquet(dst)
+    print(f'wrote {len(df):,} sales to {dst}')
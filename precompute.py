@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import combinations_with_replacement
+
+import numpy as np
+import pandas as pd
+
+from counties import county_partition, partition_loader
+from dash_config import county_dict, dash_variable_dict, regional_path, year_built_dict
+from formatting import break_methods
+from housing_cube import HousingCube
+from query_layer import FilterState, QueryLayer
+from refresh import load_base
+from sales_data import dashboard_columns
+from tract_geometry import lod_path, write_tract_levels
+
+# where the precomputed artifacts are written, one directory per county (county=<name>/)
+precompute_path = 'Data/Precomputed'
+
+# number of choropleth classes the class breaks are computed for, matching the map's colors
+n_classes = 4
+
+
+# a county's sales, from its partition of the regional dataset or the Rockdale base build
+def county_sales(county, settings, regional=regional_path):
+    if settings.get('sales') == 'base':
+        return load_base()
+
+    partition = settings.get('sales') or county_partition(county, regional)
+    return partition_loader(county, partition, dashboard_columns)()
+
+
+# every (first, last) vintage range the sidebar slider can select
+def vintage_ranges():
+    vintages = list(year_built_dict)
+    return [(vintages[first], vintages[last])
+            for first, last in combinations_with_replacement(range(len(vintages)), 2)]
+
+
+# the artifacts of one county's year of sales, built in a worker process: each tract's value of every
+# dash variable for every vintage range (through the same query layer as the dashboard's map), & the
+# year's months of the chart's monthly series. Months & single years never span two partitions, so the
+# merge only has to put the years back in order
+def year_task(county, year, df):
+    start = time.perf_counter()
+    queries = QueryLayer(HousingCube(df), max_entries=0)
+
+    tract_frames = []
+    for year_built in vintage_ranges():
+        for dash_variable, (column, *_) in dash_variable_dict.items():
+            grouped_df = queries.map_frame(FilterState((year, year), year_built, None, dash_variable))
+            tract_frames.append(pd.DataFrame({
+                'year': year,
+                'year_built': '|'.join(year_built),
+                'dash_variable': dash_variable,
+                'GEOID': grouped_df['GEOID'].astype(str),
+                'Sub_geo': grouped_df['Sub_geo'].astype(str),
+                'value': grouped_df[column].astype('float64'),
+                'total_sales': grouped_df['yr_built'].astype('int64')
+            }))
+
+    store = queries.monthly
+    monthly_frames = [
+        pd.DataFrame({
+            'month': store.index.astype(str),
+            'year_built': '|'.join(year_built),
+            'sub_geo': '' if sub_geo is None else '|'.join(sub_geo),
+            'dash_variable': dash_variable,
+            'value': values
+        })
+        for year_built, sub_geo, dash_variable, values in store.monthly_series()
+    ]
+
+    return {
+        'county': county,
+        'year': year,
+        'tracts': pd.concat(tract_frames, ignore_index=True),
+        'monthly': pd.concat(monthly_frames, ignore_index=True),
+        'seconds': time.perf_counter() - start
+    }
+
+
+# simplified tract geometry for one county, built in a worker process
+def geometry_task(county, tracts, dst):
+    start = time.perf_counter()
+    write_tract_levels(tracts, dst)
+    return {'county': county, 'year': None, 'seconds': time.perf_counter() - start}
+
+
+# put a county's years back together: tract values in year order, the monthly series over every month
+# from the first sale to the last (months without sales are 0 for counts & NaN for medians, as in the
+# dashboard's store), & class breaks from every tract's value in every year, as the dashboard computes them
+def merge_county(results):
+    results = sorted(results, key=lambda result: result['year'])
+    sort_keys = ['year', 'year_built', 'dash_variable', 'GEOID']
+    tracts = pd.concat([result['tracts'] for result in results], ignore_index=True).sort_values(
+        sort_keys, kind='stable', ignore_index=True)
+
+    monthly = pd.concat([result['monthly'] for result in results], ignore_index=True)
+    months = pd.period_range(pd.Period(monthly['month'].min(), 'M'), pd.Period(monthly['month'].max(), 'M'),
+                             freq='M').astype(str)
+    series_keys = ['year_built', 'sub_geo', 'dash_variable']
+    grid = pd.MultiIndex.from_product(
+        [sorted(monthly[key].unique()) for key in series_keys] + [months], names=series_keys + ['month'])
+    monthly = monthly.set_index(series_keys + ['month'])['value'].reindex(grid).reset_index()
+    counts = monthly['dash_variable'].map(lambda name: dash_variable_dict[name][1] == 'count')
+    monthly.loc[counts, 'value'] = monthly.loc[counts, 'value'].fillna(0)
+
+    # every tract's value in every year, over every vintage & the whole county
+    all_vintages = '|'.join((list(year_built_dict)[0], list(year_built_dict)[-1]))
+    breaks = {}
+    for dash_variable in dash_variable_dict:
+        selected = tracts[(tracts['year_built'] == all_vintages) & (tracts['dash_variable'] == dash_variable)]
+        values = selected['value'].to_numpy()
+        breaks[dash_variable] = {method: np.asarray(compute(values, n_classes)).tolist()
+                                 for method, compute in break_methods.items()}
+
+    return tracts, monthly, breaks
+
+
+def write_county(county, tracts, monthly, breaks, out):
+    os.makedirs(out, exist_ok=True)
+    tracts.to_parquet(os.path.join(out, 'tract_values.parquet'), index=False)
+    monthly.to_parquet(os.path.join(out, 'monthly_series.parquet'), index=False)
+    with open(os.path.join(out, 'class_breaks.json'), 'w') as f:
+        json.dump(breaks, f, indent=2)
+
+
+# build every county's artifacts, split into one task per county & year (plus one per county for the
+# geometry) across a process pool. Results are merged in county & year order, whatever order they finish in
+def precompute(counties, out=precompute_path, workers=None, regional=regional_path):
+    start = time.perf_counter()
+    tasks = {}
+    report = {'counties': {}, 'tasks': []}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for county in counties:
+            settings = county_dict[county]
+            county_out = os.path.join(out, f'county={county}')
+            os.makedirs(county_out, exist_ok=True)
+
+            # the geometry levels go next to the tracts, where the dashboard loads them from
+            tasks[pool.submit(geometry_task, county, settings['tracts'], lod_path(settings['tracts']))] = county
+
+            df = county_sales(county, settings, regional)
+            for year, year_df in df.groupby('year', sort=True):
+                tasks[pool.submit(year_task, county, int(year), year_df)] = county
+
+        results = {county: [] for county in counties}
+        for done, future in enumerate(as_completed(tasks), 1):
+            result = future.result()
+            label = f"{result['county']} {result['year'] or 'geometry'}"
+            print(f"[{done}/{len(tasks)}] {label}: {result['seconds']:.2f} s")
+            report['tasks'].append({'county': result['county'], 'year': result['year'],
+                                    'seconds': result['seconds']})
+            if result['year'] is not None:
+                results[result['county']].append(result)
+
+    for county in counties:
+        merge_start = time.perf_counter()
+        tracts, monthly, breaks = merge_county(results[county])
+        write_county(county, tracts, monthly, breaks, os.path.join(out, f'county={county}'))
+        report['counties'][county] = {
+            'years': len(results[county]),
+            'tract_rows': len(tracts),
+            'monthly_rows': len(monthly),
+            'merge_seconds': time.perf_counter() - merge_start
+        }
+
+    report['tasks'].sort(key=lambda task: (task['county'], task['year'] or 0))
+    report['wall_seconds'] = time.perf_counter() - start
+    report['task_seconds'] = sum(task['seconds'] for task in report['tasks'])
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Precompute the dashboard's tract values, monthly series, class breaks & simplified "
+                    "geometry for every county, in parallel by county & year.")
+    parser.add_argument('--counties', nargs='+', default=list(county_dict), help='counties to precompute')
+    parser.add_argument('--out', default=precompute_path, help='output directory')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (defaults to the CPU count)')
+    args = parser.parse_args()
+
+    report = precompute(args.counties, args.out, args.workers)
+    with open(os.path.join(args.out, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"precomputed {len(args.counties)} count{'y' if len(args.counties) == 1 else 'ies'} in"
+          f" {report['wall_seconds']:.1f} s ({report['task_seconds']:.1f} s of task time)")
@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+from housing_cube import HousingCube, cube_keys, cube_measures
+
+# default rank error of the median sketches, as a fraction of the sales in the selection
+sketch_error = 0.01
+
+
+# number of points a cell keeps for the given rank error
+def sketch_size(error):
+    return int(np.ceil(1 / error))
+
+
+# weighted median of every group, where values & weights are sorted by group, then by value.
+# Ties at exactly half the weight average the two middle values, so unit weights match pandas' median
+def weighted_medians(keys, values, weights):
+    group_keys, group_starts = np.unique(keys, return_index=True)
+    group_ends = np.append(group_starts[1:], len(keys))
+
+    cumulative = np.cumsum(weights)
+    before = np.concatenate([[0], cumulative])[group_starts]
+    half = before + (cumulative[group_ends - 1] - before) / 2
+
+    # first value whose cumulative weight reaches half of its group's weight
+    middle = np.searchsorted(cumulative, half * (1 - 1e-12), side='left')
+    middle = np.minimum(middle, group_ends - 1)
+
+    exactly_half = (np.abs(cumulative[middle] - half) <= 1e-9 * np.maximum(half, 1)) & (middle + 1 < group_ends)
+    upper = np.where(exactly_half, middle + 1, middle)
+
+    return group_keys, (values[middle] + values[upper]) / 2
+
+
+# positions of the points each cell keeps when its points (sorted by value within the cell, each with a
+# weight) are compacted to at most k: all of them for cells with k or fewer, or for larger cells the
+# points at the middle of k equal blocks of the cell's weight. Returns the positions, each cell's number of
+# kept points & the weight each of its kept points stands for
+def compact_points(lengths, weights, k):
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    cumulative = np.cumsum(weights)
+    before = cumulative[starts] - weights[starts]
+    totals = cumulative[ends - 1] - before
+
+    kept = np.minimum(lengths, k)
+    cell = np.repeat(np.arange(len(lengths)), kept)
+    j = np.arange(kept.sum()) - np.repeat(np.cumsum(kept) - kept, kept)
+
+    ranks = np.searchsorted(cumulative, before[cell] + (j + 0.5) * totals[cell] / k, side='left')
+    positions = np.where(lengths[cell] > k, np.minimum(ranks, ends[cell] - 1), starts[cell] + j)
+
+    return positions, kept, np.where(lengths > k, totals / k, 1.0)
+
+
+class SketchCube(HousingCube):
+
+    # the aggregate cube with a mergeable quantile sketch in place of every cell's values: at most 1 / error
+    # evenly spaced values from the cell's sorted values, each weighted by the number of sales it stands for.
+    # Cells with fewer sales keep all of their values, so they're exact. A median over any selection merges
+    # the sketches of the selected cells & is within error * (sales selected) ranks of the exact median.
+    # Only the sketches are kept, so the cube holds at most 1 / error values per cell & measure
+    def __init__(self, df, error=sketch_error):
+        self._from_exact(HousingCube(df), error)
+
+    @classmethod
+    def from_cube(cls, cube, error=sketch_error):
+        sketched = cls.__new__(cls)
+        sketched._from_exact(cube, error)
+        return sketched
+
+    # sketch every cell of an exact cube. Its values are already sorted within each cell, so the kept
+    # positions are the same for every measure
+    def _from_exact(self, cube, error):
+        self.error = error
+        self.geoid_lookup = cube.geoid_lookup
+        self.month_lookup = cube.month_lookup
+
+        counts = cube.cells['count'].to_numpy()
+        positions, points, weight = compact_points(counts, np.ones(counts.sum()), sketch_size(error))
+        self.sketches = {measure: cube.values[measure][positions] for measure in cube_measures}
+        self._set_cells(cube.cells[cube_keys + ['count']], points, weight)
+
+    # the cells, with where each cell's sketch starts, its number of points & the weight of each point
+    def _set_cells(self, cells, points, weight):
+        self.cells = cells.reset_index(drop=True).assign(
+            start=np.concatenate([[0], np.cumsum(points)[:-1]]).astype('int64'),
+            points=points,
+            weight=weight
+        )
+
+    def _median_points(self, cells):
+        points = cells['points'].to_numpy()
+        positions = np.repeat(
+            cells['start'].to_numpy() - np.cumsum(points) + points, points) + np.arange(points.sum())
+        return positions, points, np.repeat(cells['weight'].to_numpy(), points)
+
+    # medians of the merged sketches. Groups made only of exact cells take the plain median of their values;
+    # the rest are sorted by group & value for their weighted medians
+    def _group_medians(self, measure, positions, groups, weights):
+        values = self.sketches[measure][positions]
+
+        sketched = np.isin(groups, np.unique(groups[weights > 1]))
+        medians = pd.Series(values[~sketched]).groupby(groups[~sketched]).median()
+        if not sketched.any():
+            return medians
+
+        values, groups, weights = values[sketched], groups[sketched], weights[sketched]
+
+        # sort by value, then stably by group (a radix sort when the group numbers fit in 16 bits)
+        order = np.argsort(values)
+        order = order[np.argsort(groups[order].astype('int16' if groups.max() < 2 ** 15 else 'int64'), kind='stable')]
+        group_keys, group_medians = weighted_medians(groups[order], values[order], weights[order])
+        return pd.concat([medians, pd.Series(group_medians, index=group_keys)]).sort_index()
+
+    # a single selection goes through the same batched pass as many
+    def rollup(self, mask, by, aggs):
+        return self.rollup_batch([mask], by, aggs)[0]
+
+    # fold new sales in by sketching them & merging the sketches of the cells found in both cubes: their
+    # points are pooled, sorted by value & compacted again (a cell merged many times may drift a little past
+    # the rank error until the cube is rebuilt from the sales)
+    def merge(self, df):
+        delta = SketchCube(df, self.error)
+        n_points = len(self.sketches[cube_measures[0]])
+
+        # line up the cells of both cubes by key, with the old sketch of a cell ahead of the new one
+        cells = pd.concat([
+            self.cells,
+            delta.cells.assign(start=delta.cells['start'] + n_points)
+        ], ignore_index=True)
+        cells = cells.astype({'GEOID': 'category', 'Sub_geo': 'category', 'year-month': 'category'})
+        cells = cells.sort_values(cube_keys, kind='stable')
+
+        positions, points, weights = self._median_points(cells)
+        cell_id = np.repeat(cells.groupby(cube_keys, sort=False, observed=True).ngroup().to_numpy(), points)
+
+        merged_cells = cells.groupby(cube_keys, sort=True, observed=True).agg(
+            count=('count', 'sum'),
+            pooled=('points', 'sum')
+        ).reset_index()
+        pooled = merged_cells.pop('pooled').to_numpy()
+
+        merged = SketchCube.__new__(SketchCube)
+        merged.error = self.error
+        merged.sketches = {}
+        for measure in cube_measures:
+            values = np.concatenate([self.sketches[measure], delta.sketches[measure]])[positions]
+            order = np.lexsort((values, cell_id))
+            kept, kept_points, kept_weight = compact_points(pooled, weights[order], sketch_size(self.error))
+            merged.sketches[measure] = values[order][kept]
+
+        merged._set_cells(merged_cells, kept_points, kept_weight)
+
+        # the newest sales win if a lookup value ever changes
+        geoid_lookup = pd.concat([self.geoid_lookup, delta.geoid_lookup])
+        merged.geoid_lookup = geoid_lookup[~geoid_lookup.index.duplicated(keep='last')]
+        month_lookup = pd.concat([self.month_lookup, delta.month_lookup])
+        merged.month_lookup = month_lookup[~month_lookup.index.duplicated(keep='last')]
+
+        return merged
+
+    @property
+    def nbytes(self):
+        return (sum(values.nbytes for values in self.sketches.values())
+                + int(self.cells.memory_usage(deep=True).sum())
+                + int(self.geoid_lookup.memory_usage(deep=True).sum())
+                + int(self.month_lookup.memory_usage(deep=True).sum()))
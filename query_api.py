@@ -0,0 +1,244 @@
+import argparse
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from counties import CountyEngine
+from dash_config import county_dict, dash_variable_dict, default_county, year_built_dict
+from kpis import compare_ytd_default, kpi_change_metrics, lookup_change, ytd_comparable
+from query_layer import normalize_filters
+from timeseries import rolling_windows
+
+logger = logging.getLogger(__name__)
+
+# the kinds of query a spec can ask for: tract values for the map, the monthly trend, or the KPIs
+query_kinds = ['map', 'chart', 'kpis']
+
+# most queries one request may hold
+max_queries = 1000
+
+# content type of the Arrow IPC stream responses
+arrow_content_type = 'application/vnd.apache.arrow.stream'
+
+
+# validate one query spec & fill in the dashboard's sidebar defaults for anything it leaves out. A spec
+# is a dict like {'query': 'map', 'county': 'Rockdale', 'years': [2021, 2023], 'year_built': ['<2000',
+# '2011-2023'], 'sub_geo': ['Conyers'], 'dash_variable': 'Price (per SF)'}, plus 'window' (months) for a
+# smoothed chart & 'like_for_like' for the KPIs' YoY changes. Without it, like_for_like is left as None & takes
+# the dashboard's default once the county's cube is known: the checkbox's default, where the checkbox is offered
+def parse_spec(spec, counties=county_dict):
+    if not isinstance(spec, dict):
+        raise ValueError('every query must be a JSON object')
+
+    kind = spec.get('query', 'kpis')
+    if kind not in query_kinds:
+        raise ValueError(f"unknown query {kind!r}, expected one of {', '.join(query_kinds)}")
+
+    county = spec.get('county', default_county)
+    if county not in counties:
+        raise ValueError(f'{county} County is not configured')
+    settings = counties[county]
+
+    transaction_years = settings['transaction_years']
+    years = spec.get('years', (transaction_years[-3], transaction_years[-1]))
+    if len(years) != 2 or not all(year in transaction_years for year in years) or years[0] > years[1]:
+        raise ValueError(f'years must be a [first, last] pair within {transaction_years[0]}-{transaction_years[-1]}')
+
+    vintages = list(year_built_dict)
+    year_built = spec.get('year_built', (vintages[0], vintages[-1]))
+    if len(year_built) != 2 or not all(vintage in vintages for vintage in year_built) \
+            or vintages.index(year_built[0]) > vintages.index(year_built[1]):
+        raise ValueError(f"year_built must be a [first, last] pair of {', '.join(vintages)}")
+
+    sub_geo = spec.get('sub_geo') or []
+    unknown = set(sub_geo) - set(settings['sub_geos'])
+    if unknown:
+        raise ValueError(f"unknown sub_geo {', '.join(sorted(unknown))}")
+
+    dash_variable = spec.get('dash_variable', 'Price (per SF)')
+    if dash_variable not in dash_variable_dict:
+        raise ValueError(f"dash_variable must be one of {', '.join(dash_variable_dict)}")
+
+    window = spec.get('window')
+    if window is not None and window not in rolling_windows:
+        raise ValueError(f"window must be one of {', '.join(map(str, rolling_windows))}")
+
+    state = normalize_filters(years, year_built, 'City/Region' if sub_geo else 'Entire county', sub_geo,
+                              dash_variable)
+
+    return {
+        'query': kind,
+        'county': county,
+        'state': state,
+        'window': window,
+        'like_for_like': None if spec.get('like_for_like') is None else bool(spec['like_for_like'])
+    }
+
+
+# tract values for the map: GEOID, Sub_geo, the dash variable's value & the number of sales
+def map_result(grouped_df, state):
+    column = dash_variable_dict[state.dash_variable][0]
+    return pd.DataFrame({
+        'GEOID': grouped_df['GEOID'].astype(str),
+        'Sub_geo': grouped_df['Sub_geo'].astype(str),
+        'value': grouped_df[column].astype('float64'),
+        'total_sales': grouped_df['yr_built'].astype('int64')
+    })
+
+
+# the monthly trend, with months as 'YYYY-MM'
+def chart_result(series):
+    return pd.DataFrame({'month': series.index.strftime('%Y-%m'), 'value': series.to_numpy()})
+
+
+# the KPIs for the whole selection, plus their change from the first selected year to the last
+def kpi_result(kpi_totals, changes, state):
+    row = kpi_totals.to_dict()
+    for kpi in kpi_change_metrics:
+        row[f'change_{kpi}'] = (np.nan if state.years[0] == state.years[1]
+                                else lookup_change(changes, state.years[0], state.years[1], kpi))
+    return pd.DataFrame([row]).astype({'total_sales': 'int64'})
+
+
+# answer many query specs at once. Specs are grouped by county & kind, so the map & KPI queries of each
+# group are rolled up together in one batched pass (cached results are reused). Returns one DataFrame per spec
+def run_queries(engine, specs):
+    parsed = [parse_spec(spec, engine.counties) for spec in specs]
+    results = [None] * len(parsed)
+
+    groups = {}
+    for i, spec in enumerate(parsed):
+        groups.setdefault((spec['county'], spec['query']), []).append(i)
+
+    for (county, kind), indices in groups.items():
+        queries = engine.get(county).queries
+        states = [parsed[i]['state'] for i in indices]
+
+        if kind == 'map':
+            for i, grouped_df in zip(indices, queries.map_frames(states)):
+                results[i] = map_result(grouped_df, parsed[i]['state'])
+
+        elif kind == 'chart':
+            for i in indices:
+                results[i] = chart_result(queries.chart_series(parsed[i]['state'], parsed[i]['window']))
+
+        else:
+            for i, kpi_totals in zip(indices, queries.kpi_totals_batch(states)):
+                like_for_like = parsed[i]['like_for_like']
+                if like_for_like is None:
+                    like_for_like = compare_ytd_default and ytd_comparable(queries.cube, parsed[i]['state'].years)
+                changes = queries.kpi_changes(parsed[i]['state'], like_for_like)
+                results[i] = kpi_result(kpi_totals, changes, parsed[i]['state'])
+
+    return results
+
+
+# JSON response: one list of records per query, with NaN as null
+def to_json(results):
+    return json.dumps({'results': [json.loads(df.to_json(orient='records')) for df in results]}).encode()
+
+
+# Arrow IPC stream response: every result in one table, with a 'query' column holding each row's position
+# in the request. Columns a query doesn't have are null for its rows
+def to_arrow(results):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(
+        pd.concat([df.assign(query=i) for i, df in enumerate(results)], ignore_index=True), preserve_index=False)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    # GET /health, & POST /query with {"queries": [spec, ...]}. Responses are JSON unless ?format=arrow is
+    # given or the Accept header asks for an Arrow stream
+    engine = None
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._send(200, b'ok', 'text/plain')
+        else:
+            self._send_error(404, 'not found')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/query':
+            self._send_error(404, 'not found')
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            specs = body.get('queries', []) if isinstance(body, dict) else body
+            if not isinstance(specs, list) or not specs:
+                raise ValueError('expected {"queries": [...]} with at least one query')
+            if len(specs) > max_queries:
+                raise ValueError(f'at most {max_queries} queries per request')
+
+            results = run_queries(self.engine, specs)
+        except (ValueError, TypeError) as error:
+            self._send_error(400, str(error))
+            return
+        except Exception:
+            logger.exception('query failed')
+            self._send_error(500, 'query failed')
+            return
+
+        arrow = (parse_qs(url.query).get('format', [''])[0] == 'arrow'
+                 or arrow_content_type in self.headers.get('Accept', ''))
+        if arrow:
+            self._send(200, to_arrow(results), arrow_content_type)
+        else:
+            self._send(200, to_json(results), 'application/json')
+
+    def _send(self, status, payload, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({'error': message}).encode(), 'application/json')
+
+    def log_message(self, format, *args):
+        logger.info('%s %s', self.address_string(), format % args)
+
+
+# serve the queries over HTTP, sharing one county engine (& its caches) across every request
+def serve(host='127.0.0.1', port=8600, engine=None):
+    handler = type('Handler', (QueryHandler,), {'engine': engine or CountyEngine()})
+    server = ThreadingHTTPServer((host, port), handler)
+    logger.info('serving queries on http://%s:%d', host, port)
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Serve the dashboard's map, chart & KPI queries over a local HTTP endpoint.")
+    parser.add_argument('--host', default='127.0.0.1', help='interface to listen on')
+    parser.add_argument('--port', type=int, default=8600, help='port to listen on')
+    parser.add_argument('--prewarm', nargs='*', default=[default_county],
+                        help='counties to load before the first request')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
+    engine = CountyEngine()
+    if args.prewarm:
+        engine.prewarm(args.prewarm)
+
+    server = serve(args.host, args.port, engine)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
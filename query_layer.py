@@ -0,0 +1,217 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from dash_config import dash_variable_dict
+from formatting import break_methods
+from kpis import kpi_changes
+from timeseries import MonthlyStore
+
+# the sidebar filter state every query is keyed on
+FilterState = namedtuple(
+    'FilterState', ['years', 'year_built', 'sub_geo', 'dash_variable'])
+
+
+# normalize the raw sidebar values so equivalent selections share one cache entry
+def normalize_filters(years, year_built, geography_included, sub_geo, dash_variable):
+
+    # the sub-geography filter only applies to the 'City/Region' selection & its order doesn't matter
+    if geography_included == 'City/Region':
+        sub_geo = tuple(sorted(set(sub_geo)))
+    else:
+        sub_geo = None
+
+    return FilterState(
+        years=(int(years[0]), int(years[1])),
+        year_built=(year_built[0], year_built[1]),
+        sub_geo=sub_geo,
+        dash_variable=dash_variable
+    )
+
+# the KPIs for the whole selection & how each one is rolled up
+kpi_total_aggs = {
+    'median_vintage': ('yr_built', 'median'),
+    'median_sf': ('square_feet', 'median'),
+    'total_sales': ('price_sf', 'count'),
+    'median_price_sf': ('price_sf', 'median'),
+    'median_price': ('sale_price', 'median')
+}
+
+
+class QueryLayer:
+
+    # wrap the aggregate cube with a bounded, least-recently-used cache shared by every session
+    def __init__(self, cube, max_entries=512):
+        self.cube = cube
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._trace = threading.local()
+        self._monthly = None
+        self._monthly_lock = threading.Lock()
+
+    # record (query, hit) for every lookup this thread makes into the list, or stop with None. Each
+    # Streamlit session reruns in its own thread, so a rerun only sees its own lookups
+    def trace(self, outcomes):
+        self._trace.outcomes = outcomes
+
+    # return the cached value for the key, computing & storing it on a miss
+    def _cached(self, key, compute):
+        outcomes = getattr(self._trace, 'outcomes', None)
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                if outcomes is not None:
+                    outcomes.append((key[0], True))
+                return self._cache[key]
+
+        if outcomes is not None:
+            outcomes.append((key[0], False))
+
+        value = compute()
+
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+
+            # evict the oldest entries once the cache is over budget
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+        return value
+
+    # look up many keys at once, computing every miss with one call to compute_many(missing keys), which
+    # returns their values in the same order
+    def _cached_many(self, keys, compute_many):
+        outcomes = getattr(self._trace, 'outcomes', None)
+        values = {}
+
+        with self._lock:
+            for key in keys:
+                if key in self._cache and key not in values:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    values[key] = self._cache[key]
+
+        missing = list(dict.fromkeys(key for key in keys if key not in values))
+        if outcomes is not None:
+            outcomes.extend((key[0], key not in missing) for key in keys)
+
+        if missing:
+            computed = compute_many(missing)
+
+            with self._lock:
+                self.misses += len(missing)
+                for key, value in zip(missing, computed):
+                    values[key] = value
+                    self._cache[key] = value
+                    self._cache.move_to_end(key)
+
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+        return [values[key] for key in keys]
+
+    # cells within the transaction year, construction vintage, and sub-geography filters (map & KPIs)
+    def map_mask(self, state):
+        return self._cached(
+            ('map_mask', state.years, state.year_built, state.sub_geo),
+            lambda: self.cube.select(state.years, state.year_built, state.sub_geo))
+
+    # map data grouped by GEOID, i.e. Census tract
+    def map_frame(self, state):
+        return self.map_frames([state])[0]
+
+    # map data for many filter states, with every state that isn't cached rolled up in one batched pass
+    def map_frames(self, states):
+        frames = self._cached_many(
+            [('map_frame', state.years, state.year_built, state.sub_geo, state.dash_variable) for state in states],
+            self._group_maps)
+
+        # hand every consumer its own copy so the cached frame is never modified
+        return [grouped_df.copy() for grouped_df in frames]
+
+    def _group_maps(self, keys):
+        grouped = {}
+
+        # each dash variable aggregates its own column, so each one is its own batch
+        for dash_variable in dict.fromkeys(key[4] for key in keys):
+            column, how = dash_variable_dict[dash_variable][:2]
+            batch = [key for key in keys if key[4] == dash_variable]
+
+            masks = [self.map_mask(FilterState(*key[1:])) for key in batch]
+            results = self.cube.rollup_batch(masks, 'GEOID', {
+                # this first agg will read the dash variable and make the correct calculation
+                column: (column, how),
+
+                # this second agg will add up the total sales in each CT
+                'yr_built': ('yr_built', 'count')
+            })
+
+            # look up the name of the sub geometry for each Census tract
+            for key, grouped_df in zip(batch, results):
+                grouped[key] = grouped_df.join(self.cube.geoid_lookup).reset_index()
+
+        return [grouped[key] for key in keys]
+
+    # the monthly time-series store behind the line chart, built on first use. The store belongs to this
+    # version of the cube, so a refresh starts a new one along with the new query layer
+    @property
+    def monthly(self):
+        with self._monthly_lock:
+            if self._monthly is None:
+                self._monthly = MonthlyStore(self.cube)
+            return self._monthly
+
+    # chart data for a longitudinal trend of the dash variable: its monthly values (or their rolling
+    # average over window months) as a Series indexed by month
+    def chart_series(self, state, window=None):
+        values = self.monthly.series(state.year_built, state.sub_geo, state.dash_variable, window)
+        return pd.Series(values, index=self.monthly.index, name=state.dash_variable)
+
+    # KPI values for the whole selection
+    def kpi_totals(self, state):
+        return self.kpi_totals_batch([state])[0]
+
+    # KPI values for many filter states, with every state that isn't cached rolled up in one batched pass
+    def kpi_totals_batch(self, states):
+        totals = self._cached_many(
+            [('kpi_totals', state.years, state.year_built, state.sub_geo) for state in states],
+            lambda keys: self.cube.rollup_batch(
+                [self.map_mask(FilterState(*key[1:], None)) for key in keys], None, kpi_total_aggs))
+
+        return [kpi_totals.copy() for kpi_totals in totals]
+
+    # YoY change of every KPI between every pair of transaction years. The table doesn't depend on the
+    # selected years or dash variable, so changing either one is a lookup into the cached table
+    def kpi_changes(self, state, like_for_like=False):
+        return self._cached(
+            ('kpi_changes', state.year_built, state.sub_geo, like_for_like),
+            lambda: kpi_changes(self.cube, state.year_built, state.sub_geo, like_for_like))
+
+    # choropleth class breaks for the dash variable, computed once over the full dataset so the map
+    # colors don't shift when the filters change. The breaks classify every tract's value in every
+    # transaction year, so they cover the range of prices over the whole period
+    def class_breaks(self, dash_variable, method, n_classes):
+        return self._cached(
+            ('class_breaks', dash_variable, method, n_classes),
+            lambda: break_methods[method](self._tract_year_values(dash_variable), n_classes))
+
+    def _tract_year_values(self, dash_variable):
+        column, how = dash_variable_dict[dash_variable][:2]
+
+        values = [
+            self.cube.rollup(self.cube.select(years=(year, year)), 'GEOID', {
+                column: (column, how)
+            })[column].to_numpy()
+            for year in self.cube.years
+        ]
+
+        return np.concatenate(values)
@@ -0,0 +1,128 @@
+import glob
+import logging
+import os
+import threading
+
+import pandas as pd
+
+from housing_cube import HousingCube
+from query_layer import QueryLayer
+from sales_data import csv_path, dashboard_columns, feather_path, load_sales, read_partition
+
+logger = logging.getLogger(__name__)
+
+# directory where new joined sales are published as partition files, & the marker file that's rewritten
+# after every publish. Partitions that have been folded into the base dataset should be removed from here
+updates_path = 'Geocode/Updates'
+version_marker = 'VERSION'
+
+# partition file types the refresher picks up
+partition_patterns = ['*.feather', '*.parquet', '*.csv']
+
+
+# the base dataset the dashboard loads from
+def load_base():
+    return load_sales(dashboard_columns)
+
+
+class DatasetRefresher:
+
+    # load the base dataset plus any published partitions, then serve them through a query layer.
+    # backend builds the cube from whatever the loader returns (a DataFrame for HousingCube)
+    def __init__(self, loader=load_base, updates=updates_path, poll_seconds=60, max_entries=512,
+                 base_paths=(csv_path, feather_path), backend=HousingCube):
+        self.loader = loader
+        self.backend = backend
+        self.updates = updates
+        self.poll_seconds = poll_seconds
+        self.max_entries = max_entries
+        self.base_paths = base_paths
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.version = self._read_marker()
+        self._full_load()
+
+    # contents & modification time of the version marker (None until the first publish)
+    def _read_marker(self):
+        path = os.path.join(self.updates, version_marker)
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as f:
+            return f.read().strip(), os.path.getmtime(path)
+
+    # modification time of the base dataset, so a rebuilt base triggers a full reload
+    def _base_stamp(self):
+        return tuple(os.path.getmtime(p) for p in self.base_paths if os.path.exists(p))
+
+    def _partitions(self):
+        paths = []
+        for pattern in partition_patterns:
+            paths += glob.glob(os.path.join(self.updates, pattern))
+        return sorted(paths)
+
+    def _read_partitions(self, paths):
+        return pd.concat([read_partition(path, dashboard_columns) for path in paths], ignore_index=True)
+
+    # rebuild the cube from the base dataset & every published partition
+    def _full_load(self):
+        cube = self.backend(self.loader())
+        partitions = self._partitions()
+        if partitions:
+            cube = cube.merge(self._read_partitions(partitions))
+
+        self.base_stamp = self._base_stamp()
+        self.loaded = set(partitions)
+        self.queries = QueryLayer(cube, self.max_entries)
+
+    # check the version marker & fold in any partitions published since the last load. The new
+    # query layer replaces the old one in a single assignment, so a rerun that already holds the
+    # old one finishes on it while the next rerun picks up the new version
+    def refresh(self):
+
+        # skip this check if another thread is already refreshing
+        if not self._lock.acquire(blocking=False):
+            return False
+
+        try:
+            version = self._read_marker()
+            if version == self.version and self._base_stamp() == self.base_stamp:
+                return False
+
+            if self._base_stamp() != self.base_stamp:
+                self._full_load()
+                logger.info('reloaded the base dataset (version %s)', version)
+            else:
+                new = [path for path in self._partitions() if path not in self.loaded]
+                if new:
+                    cube = self.queries.cube.merge(self._read_partitions(new))
+                    self.loaded.update(new)
+                    self.queries = QueryLayer(cube, self.max_entries)
+                    logger.info('added %d new partition(s) (version %s)', len(new), version)
+
+            self.version = version
+            return True
+
+        finally:
+            self._lock.release()
+
+    # poll for new versions in a background daemon thread
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def poll():
+            while not self._stop.wait(self.poll_seconds):
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception('dataset refresh failed')
+
+        self._thread = threading.Thread(target=poll, name='dataset-refresh', daemon=True)
+        self._thread.start()
+
+    # stop polling, e.g. once the dataset has been evicted
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,165 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from housing_cube import vintage_bucket, vintage_codes
+
+# the column the repeat sales are paired on, read along with the dashboard's columns
+parcel_columns = ['Parcel ID']
+
+# months per index period. Only about one sale in eight is a repeat sale, so monthly periods would be
+# too thin to estimate
+index_months = 3
+
+# pairs closer together than this are dropped: they're mostly flips, whose price change is the renovation
+min_pair_months = 6
+
+# pairs whose price changed by more than this factor either way are dropped as data errors or rebuilds
+max_pair_change = 3
+
+
+# pair every sale with the same parcel's next sale through one sort, rather than joining the sales to
+# themselves: after sorting by parcel & month, a parcel's sales sit next to each other. Returns the
+# positions of the first & second sale of each pair
+def consecutive_pairs(parcels, months):
+    order = np.lexsort((months, parcels))
+    same = parcels[order][1:] == parcels[order][:-1]
+    return order[:-1][same], order[1:][same]
+
+
+class RepeatSalesIndex:
+
+    # a quality-adjusted price index from the parcels that sold more than once (Case-Shiller's weighted
+    # repeat-sales method), so it doesn't move with the mix of homes sold the way a median does. The sales
+    # are paired once per dataset version, & each filter slice's index is solved on first use & kept
+    def __init__(self, df, period_months=index_months):
+        df = df[df['Parcel ID'].notna()]
+
+        months = df['year'].to_numpy(dtype='int64') * 12 + df['month'].to_numpy(dtype='int64') - 1
+        first, second = consecutive_pairs(df['Parcel ID'].astype('category').cat.codes.to_numpy(), months)
+
+        # the same structure at both sales, far enough apart & within a plausible change in price
+        price = df['sale_price'].to_numpy(dtype='float64')
+        log_change = np.log(price[second] / price[first])
+        keep = ((months[second] - months[first] >= min_pair_months)
+                & (df['yr_built'].to_numpy()[first] == df['yr_built'].to_numpy()[second])
+                & (df['square_feet'].to_numpy()[first] == df['square_feet'].to_numpy()[second])
+                & (np.abs(log_change) <= np.log(max_pair_change)))
+        first, second = first[keep], second[keep]
+
+        # the index periods, each labeled by its first month
+        start = months.min()
+        self.period_months = period_months
+        self.n_periods = int((months.max() - start) // period_months + 1)
+        self.index = pd.period_range(pd.Period(year=start // 12, month=start % 12 + 1, freq='M'),
+                                     periods=self.n_periods * period_months, freq='M')[::period_months]
+
+        self.first_period = ((months[first] - start) // period_months).astype('int32')
+        self.second_period = ((months[second] - start) // period_months).astype('int32')
+        self.log_change = log_change[keep]
+        self.gap = (months[second] - months[first]).astype('float64')
+
+        vintage = vintage_bucket(df['yr_built'].to_numpy()[second])
+        self.vintage = vintage.astype('int8')
+
+        sub_geo = df['Sub_geo'].astype('category')
+        self.sub_geo_categories = sub_geo.cat.categories
+        self.sub_geo = sub_geo.cat.codes.to_numpy()[second]
+
+        geoid = df['GEOID'].astype(str).astype('category')
+        self.geoid_categories = geoid.cat.categories
+        self.geoid = geoid.cat.codes.to_numpy()[second]
+
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    # the pairs within the vintage & sub-geography filters
+    def mask(self, year_built, sub_geo):
+        mask = np.isin(self.vintage, vintage_codes(year_built))
+        if sub_geo is not None:
+            mask &= np.isin(self.sub_geo, self.sub_geo_categories.get_indexer(sub_geo))
+        return mask
+
+    # solve the index of every group at once, as one sparse block-diagonal regression of each pair's change
+    # in log price on its two periods (-1 at the first, +1 at the second). A first pass by least squares
+    # gives the residuals; as in Case-Shiller, their spread grows with the time between the sales, so the
+    # second pass weights each pair by the inverse of its expected spread. Each group's index is 100 in its
+    # first period with pairs, & NaN in periods that no chain of pairs links back to that one
+    def _solve(self, mask, groups, n_groups):
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import connected_components
+        from scipy.sparse.linalg import lsqr
+
+        n_pairs = int(mask.sum())
+        index = np.full((n_groups, self.n_periods), np.nan)
+        if n_pairs == 0:
+            return index
+
+        offset = groups[mask].astype('int64') * self.n_periods
+        rows = np.repeat(np.arange(n_pairs), 2)
+        columns = np.column_stack([offset + self.first_period[mask], offset + self.second_period[mask]]).ravel()
+        values = np.tile([-1.0, 1.0], n_pairs)
+        design = csr_matrix((values, (rows, columns)), shape=(n_pairs, n_groups * self.n_periods))
+        log_change = self.log_change[mask]
+        gap = self.gap[mask]
+
+        coefficients = lsqr(design, log_change, atol=1e-10, btol=1e-10)[0]
+        residuals = log_change - design @ coefficients
+        if n_pairs > 2 and np.ptp(gap) > 0:
+            slope, intercept = np.polyfit(gap, residuals ** 2, 1)
+            spread = np.sqrt(np.clip(intercept + slope * gap, np.mean(residuals ** 2) * 0.1, None))
+            weighted = csr_matrix(design.multiply(1 / spread[:, None]))
+            coefficients = lsqr(weighted, log_change / spread, atol=1e-10, btol=1e-10)[0]
+
+        # periods linked through shared pairs, so each group's index is only read where it's identified
+        linked = design.T @ design
+        n_components, component = connected_components(linked, directed=False)
+        used = np.asarray(abs(design).sum(axis=0)).ravel() > 0
+
+        coefficients = coefficients.reshape(n_groups, self.n_periods)
+        component = component.reshape(n_groups, self.n_periods)
+        used = used.reshape(n_groups, self.n_periods)
+        for group in np.flatnonzero(used.any(axis=1)):
+            base = np.flatnonzero(used[group])[0]
+            identified = used[group] & (component[group] == component[group, base])
+            index[group, identified] = 100 * np.exp(coefficients[group, identified] - coefficients[group, base])
+
+        return index
+
+    # the index for one vintage & sub-geography slice, as a Series labeled by each period's first month
+    def series(self, year_built, sub_geo):
+        key = ('series', year_built, sub_geo)
+        if key not in self._indices:
+            mask = self.mask(year_built, sub_geo)
+            values = self._solve(mask, np.zeros(len(mask), dtype='int64'), 1)[0]
+            with self._lock:
+                self._indices[key] = pd.Series(values, index=self.index, name='Repeat-sales index')
+
+        return self._indices[key]
+
+    # an index per tract ('GEOID') or per sub-geography ('Sub_geo') for the vintage slice, solved together
+    # in one regression, as a DataFrame with a column per group. Tracts have few repeat sales, so their
+    # indices are only filled in where enough pairs link the periods
+    def group_indices(self, year_built, by='Sub_geo'):
+        key = ('groups', year_built, by)
+        if key not in self._indices:
+            groups, categories = ((self.geoid, self.geoid_categories) if by == 'GEOID'
+                                  else (self.sub_geo, self.sub_geo_categories))
+            values = self._solve(self.mask(year_built, None) & (groups >= 0), groups, len(categories))
+            with self._lock:
+                self._indices[key] = pd.DataFrame(values.T, index=self.index, columns=categories)
+
+        return self._indices[key]
+
+    # the index for the chart's filters (the transaction years only move the chart's vertical lines), with
+    # each period drawn at its middle month
+    def chart_series(self, state):
+        series = self.series(state.year_built, state.sub_geo)
+        return series.set_axis(series.index + self.period_months // 2)
+
+    @property
+    def nbytes(self):
+        pairs = sum(array.nbytes for array in (self.first_period, self.second_period, self.log_change, self.gap,
+                                               self.vintage, self.sub_geo, self.geoid))
+        return pairs + sum(np.sum(index.memory_usage()) for index in self._indices.values())
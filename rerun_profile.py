@@ -0,0 +1,93 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+# set DASH_PROFILE=1 to time every rerun, & DASH_PROFILE_LOG to change where the per-rerun records go
+profile_enabled = os.environ.get('DASH_PROFILE', '') not in ('', '0')
+profile_log_path = os.environ.get('DASH_PROFILE_LOG', 'Logs/reruns.jsonl')
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+_handler_lock = threading.Lock()
+
+# the same do-nothing context is handed out for every stage when profiling is off
+_disabled_stage = contextlib.nullcontext()
+
+
+# send the JSON records to their own file, one rerun per line, so they can be aggregated offline
+def _attach_handler(path):
+    with _handler_lock:
+        if logger.handlers:
+            return
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+class RerunProfile:
+
+    # collect the stage timings of one rerun. When disabled, every method returns straight away
+    def __init__(self, enabled=profile_enabled, log_path=profile_log_path):
+        self.enabled = enabled
+        self.log_path = log_path
+        self.stages = []
+        self.cache = []
+        self.filters = None
+        self.start = time.perf_counter()
+
+        if enabled:
+            _attach_handler(log_path)
+
+    # time the code inside the with block as one stage, noting whether each query was a cache hit
+    def stage(self, name, queries=None):
+        if not self.enabled:
+            return _disabled_stage
+        return self._timed_stage(name, queries)
+
+    @contextlib.contextmanager
+    def _timed_stage(self, name, queries):
+        outcomes = []
+        if queries is not None:
+            queries.trace(outcomes)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            if queries is not None:
+                queries.trace(None)
+
+            self.stages.append({'stage': name, 'ms': round(elapsed, 3)})
+            self.cache += [{'stage': name, 'query': query, 'hit': hit} for query, hit in outcomes]
+
+    # the active filter state, recorded with the timings
+    def set_filters(self, state):
+        if self.enabled:
+            self.filters = state._asdict()
+
+    # the record for this rerun
+    def record(self):
+        return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 3),
+            'filters': self.filters,
+            'stages': self.stages,
+            'cache': self.cache
+        }
+
+    # write the rerun record to the log & return it for the debug panel
+    def finish(self):
+        if not self.enabled:
+            return None
+
+        record = self.record()
+        logger.info(json.dumps(record, default=list))
+        return record
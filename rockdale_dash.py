@@ -1,35 +1,20 @@
 import streamlit as st
-from PIL import Image
-import pandas as pd
-import geopandas as gpd
-import plotly.express as px
-import pydeck as pdk
-
-# global variable for county name
-county_var = 'Rockdale'
-
-# global variables for the pydeck chropleth map
-latitude_2D = 33.66
-latitude_3D = 33.64
-longitude_2D = -84.035
-longitude_3D = -84.06
-min_zoom = 8
-max_zoom = 15
-zoom_2D = 10  # lower values zoom out, higher values zoom in
-zoom_3D = 10.4
-map_height = 575
-
-# set choropleth colors for the map
-custom_colors = [
-    '#97a3ab',  # lightest blue
-    '#667883',
-    '#37505d',
-    '#022b3a'  # darkest blue
-]
-
-# convert the above hex list to RGB values
-custom_colors = [tuple(int(h.lstrip('#')[i:i+2], 16)
-                       for i in (0, 2, 4)) for h in custom_colors]
+from counties import CountyEngine, prewarm_enabled
+from dash_config import county_dict, dash_variable_dict, default_county
+from dash_figures import choropleth_classes, mapper_2D, mapper_3D, mapper_hex, plotly_charter, point_colors
+from hexbins import hex_resolutions, resolution_for_zoom
+from kpis import compare_ytd_default, format_change, lookup_change, months_label, ytd_comparable, ytd_months
+from query_layer import normalize_filters
+from rerun_profile import RerunProfile
+from timeseries import rolling_windows
+
+# the county to show, from the ?county= query parameter (one process serves every configured county)
+county_var = st.experimental_get_query_params().get('county', [default_county])[0]
+if county_var not in county_dict:
+    county_var = default_county
+county_settings = county_dict[county_var]
+sub_geos_list = county_settings['sub_geos']
+transaction_years = county_settings['transaction_years']
 
 # set page configurations
 st.set_page_config(
@@ -39,6 +24,30 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# per-stage timings for this rerun; costs nothing unless DASH_PROFILE is set
+profile = RerunProfile()
+
+
+# the county engine loads each county's aggregate cube, query layer & tract geometry on its first request,
+# keeps them current as new sales are published, & evicts the least recently used counties when memory runs
+# short. Every map, chart & KPI query rolls up the cube's cells
+@st.cache_resource
+def load_engine():
+    return CountyEngine()
+
+
+# on a cold start, load the county in the background while the page shell & sidebar below are drawn
+if prewarm_enabled:
+    load_engine().prewarm([county_var])
+
+
+# the logo is read from disk once per process
+@st.cache_resource
+def load_logo():
+    with open('Content/logo.png', 'rb') as f:
+        return f.read()
+
+
 # the custom CSS lives here:
 hide_default_format = """
         <style>
@@ -71,6 +80,14 @@ st.markdown(hide_default_format, unsafe_allow_html=True)
 
 # sidebarvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv
 
+# pick the county, when more than one is configured
+if len(county_dict) > 1:
+    selected_county = st.sidebar.selectbox(
+        'County', list(county_dict), index=list(county_dict).index(county_var))
+    if selected_county != county_var:
+        st.experimental_set_query_params(county=selected_county)
+        st.experimental_rerun()
+
 # Title of dashboard radio button for housing variable
 st.sidebar.markdown(
     f"<p style='text-align:center;color:#FFFFFF;font-style:italic;'>View housing data by:</p>", unsafe_allow_html=True)
@@ -83,13 +100,6 @@ dash_variable = st.sidebar.radio(
     label_visibility='collapsed'
 )
 
-# dictionary for converting housing dashboard variables into actionable values to be used in the mapping functions
-dash_variable_dict = {
-    'Total sales': ['yr_built', 'count', '{:,.0f}', 'Total sales', ',.0f'],
-    'Price (per SF)': ['price_sf', 'median', '${:.2f}', 'Median price (per SF)', '$.0f'],
-    'Price (overall)': ['sale_price', 'median', '${:,.0f}', 'Median price (overall)', '$,.0f']
-}
-
 # # Sidebar divider #1
 st.sidebar.write("---")
 
@@ -100,15 +110,8 @@ st.sidebar.markdown(
 # Transaction year sidebar slider
 years = st.sidebar.select_slider(
     'Transaction year',
-    options=[
-        2018,
-        2019,
-        2020,
-        2021,
-        2022,
-        2023
-    ],
-    value=(2021, 2023)
+    options=transaction_years,
+    value=(transaction_years[-3], transaction_years[-1])
 )
 
 # dashboard main title styling variables
@@ -137,13 +140,6 @@ year_built = st.sidebar.select_slider(
     value=('<2000', '2011-2023')
 )
 
-# dictionary for filtering by construction vintage
-year_built_dict = {
-    '<2000': [0, 1999],
-    '2000-2010': [2000, 2010],
-    '2011-2023': [2011, 2050]
-}
-
 # sub-geography slider
 geography_included = st.sidebar.radio(
     'Geography included',
@@ -152,20 +148,13 @@ geography_included = st.sidebar.radio(
     help='Filter sales by location. Defaults to entire county. "City/Region" filter will allow multi-select of smaller groupings of Census tracts within the county.'
 )
 
-# sub-geography options
-sub_geos_list = [
-    'Conyers',
-    'North Rockdale',
-    'South Rockdale'
-]
-
 # Logic & select box for the sub-geographies
 sub_geo = ""
 if geography_included == 'City/Region':
     sub_geo = st.sidebar.multiselect(
         'Select one or more cities/regions:',
         sub_geos_list,
-        ['Conyers'],
+        sub_geos_list[:1],
     )
 
 # Sidebar divider #2
@@ -187,6 +176,28 @@ if dash_variable == 'Price (per SF)' or dash_variable == 'Price (overall)':
 else:
     map_view = '2D'
 
+# Toggle from census tracts to hexagons, when the county's sales are held in memory
+if county_settings.get('backend', 'pandas') == 'pandas':
+    map_layer = st.sidebar.radio(
+        'Map layer',
+        ('Census tracts', 'Hexagons'),
+        index=0,
+        horizontal=True,
+        help='Show sales binned into hexagons instead of Census tracts, for a more detailed view within each tract.'
+    )
+else:
+    map_layer = 'Census tracts'
+
+# hexagon size, defaulting to the one that suits the map's zoom level
+if map_layer == 'Hexagons':
+    hex_size = st.sidebar.select_slider(
+        'Hexagon size',
+        options=hex_resolutions,
+        value=resolution_for_zoom(county_settings['view_2D']['zoom'], county_settings['view_2D']['latitude']),
+        format_func=lambda size: f'{size / 1000:g} km' if size >= 1000 else f'{size} m',
+        help='Distance from the center to each corner of a hexagon.'
+    )
+
 # dropdown to select the basemap
 base_map = st.sidebar.selectbox(
     'Base map',
@@ -195,425 +206,99 @@ base_map = st.sidebar.selectbox(
     help='Change underlying base map.'
 )
 
-# dictionary to change the basemap
-base_map_dict = {
-    'Streets': 'road',
-    'Satellite': 'satellite',
-    'Light': 'light',
-    'Dark': 'dark'
-}
+# toggle the individual sales on top of the map, when the county's sales are held in memory
+show_parcels = county_settings.get('backend', 'pandas') == 'pandas' and st.sidebar.checkbox(
+    'Show individual sales',
+    value=False,
+    help='Draw every sale within the filters as a point, with darker orange for a higher price per SF.'
+)
 
-# sidebar^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+# optional rolling average over the trend chart
+trend_window = st.sidebar.selectbox(
+    'Trend smoothing',
+    [None] + rolling_windows,
+    index=0,
+    format_func=lambda window: 'None' if window is None else f'{window}-month average',
+    help='Draw a rolling average of the monthly values over the trend chart.'
+)
 
+# the repeat-sales index alongside the median price, when the county's sales are held in memory
+price_variable = dash_variable_dict[dash_variable][1] == 'median'
+show_repeat_sales = county_settings.get('backend', 'pandas') == 'pandas' and price_variable and st.sidebar.checkbox(
+    'Show repeat-sales index',
+    value=False,
+    help="Draw a quality-adjusted price index from the homes that sold more than once, scaled to the median. Unlike the median, it doesn't move with the mix of homes sold."
+)
+
+# sidebar^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 
-@st.cache_data
-def load_tab_data():
-    # load the data
-    df = pd.read_csv(
-        'Geocode/RockdaleJoined_18-23.csv',
-        thousands=',',
-        keep_default_na=False
-    )
 
-    # drop Unnamed column, if it exists
-    if any(df.columns.str.startswith('Unnamed')):
-        df = df.loc[:, ~df.columns.str.startswith('Unnamed')]
+# the query layer (and its bounded cache) is shared across every session. Grab it once, so this whole
+# rerun reads from one version of the dataset even if a refresh lands partway through
+with profile.stage('load_data'):
+    county_data = load_engine().get(county_var)
+    queries = county_data.queries
 
-    # Drop the unneeded columns
-    df.drop(
-        ['Parcel ID', 'Address', 'lat', 'long', 'geometry'],
-        axis=1,
-        inplace=True)
 
-    # return this item
-    return df
+# the county's census tract geometry, already reprojected & serialized, at the level of detail that suits
+# the 2D or 3D map's zoom
+def load_geo_data():
+    return county_data.geometry(county_settings['view_3D' if map_view == '3D' else 'view_2D'])
 
 
-# initialize the dataframe by running this cached function
-df_init = load_tab_data()
+# normalize the sidebar selections once, so every consumer below asks for the same cached results
+filter_state = normalize_filters(
+    years, year_built, geography_included, sub_geo, dash_variable)
+profile.set_filters(filter_state)
 
 
 # function to filter data for the map (by year, vintage, sub_geo) & then groupby
 def filter_data_map():
+    return queries.map_frame(filter_state)
 
-    # read in dataframe
-    df = df_init
-
-    # get transaction year lower / upper bounds
-    year_lower_bound = years[0]
-    year_upper_bound = years[1]
-
-    # get construction vintage lower / upper bounds
-    vintage_lower_bound = year_built_dict[year_built[0]][0]
-    vintage_upper_bound = year_built_dict[year_built[1]][1]
-
-    # Now apply filters based on transaction year, construction vintage, and sub-geography (if applicable)
-    if geography_included == 'City/Region':  # apply a sub-geography filter
-        filtered_df = df[
-            (df['year'] >= year_lower_bound) &
-            (df['year'] <= year_upper_bound) &
-            (df['yr_built'] >= vintage_lower_bound) &
-            (df['yr_built'] <= vintage_upper_bound) &
-            (df['Sub_geo'].isin(sub_geo))]
-    else:  # do not apply a sub-geography filter
-        filtered_df = df[
-            (df['year'] >= year_lower_bound) &
-            (df['year'] <= year_upper_bound) &
-            (df['yr_built'] >= vintage_lower_bound) &
-            (df['yr_built'] <= vintage_upper_bound)
-        ]
-
-    # now group by GEOID, i.e. Census tract
-    grouped_df = filtered_df.groupby('GEOID').agg({
-        # this first agg will read the dash variable and make the correct calculation
-        dash_variable_dict[dash_variable][0]: dash_variable_dict[dash_variable][1],
-
-        # this second agg will add up the total sales in each CT
-        'yr_built': 'count',
-
-        # this third agg will get the name of the sub geometry for each Census tract
-        'Sub_geo': pd.Series.mode
-    }).reset_index()
-
-    return filtered_df, grouped_df
-
-
-# function to display 2D map
-def mapper_2D():
-
-    # tabular data
-    df = filter_data_map()[1]
-    df['GEOID'] = df['GEOID'].astype(str)
-
-    # read in geospatial
-    gdf = gpd.read_file('Geography/Rockdale_CTs.gpkg')
-
-    # join together the 2, and let not man put asunder
-    joined_df = gdf.merge(df, left_on='GEOID', right_on='GEOID')
-
-    # ensure we're working with a geodataframe
-    joined_df = gpd.GeoDataFrame(joined_df)
-
-    # gonna be ugly as sin, but format the proper column
-    joined_df['var_formatted'] = joined_df[dash_variable_dict[dash_variable][0]].apply(
-        lambda x: dash_variable_dict[dash_variable][2].format((x)))
-
-    # create a 'label' column for the above variable
-    joined_df['dashboard_var_label'] = joined_df[dash_variable_dict[dash_variable][0]].apply(
-        lambda x: dash_variable_dict[dash_variable][3].format((x)))
-
-    # set choropleth color
-    joined_df['choro_color'] = pd.cut(
-        joined_df[dash_variable_dict[dash_variable][0]],
-        bins=len(custom_colors),
-        labels=custom_colors,
-        include_lowest=True,
-        duplicates='drop'
-    )
 
-    # create map intitial state
-    initial_view_state = pdk.ViewState(
-        latitude=latitude_2D,
-        longitude=longitude_2D,
-        zoom=zoom_2D,
-        max_zoom=max_zoom,
-        min_zoom=min_zoom,
-        pitch=0,
-        bearing=0,
-        height=map_height
-    )
-
-    # create the geojson layer which will be rendered
-    geojson = pdk.Layer(
-        "GeoJsonLayer",
-        joined_df,
-        pickable=True,
-        autoHighlight=True,
-        highlight_color=[255, 255, 255, 128],
-        opacity=0.5,
-        stroked=True,
-        filled=True,
-        get_fill_color='choro_color',
-        get_line_color=[255, 255, 255, 50],
-        line_width_min_pixels=1
-    )
-
-    # configure & customize the tooltip
-    tooltip = {
-        "html": "{dashboard_var_label}: <b>{var_formatted}</b><hr style='margin: 10px auto; opacity:0.5; border-top: 2px solid white; width:85%'>\
-                    Census Tract {GEOID} <br>\
-                    {Sub_geo}",
-        "style": {"background": "rgba(2,43,58,0.7)",
-                  "border": "1px solid white",
-                  "color": "white",
-                  "font-family": "Helvetica",
-                  "text-align": "center"
-                  },
-    }
-
-    # instantiate the map object to be rendered to the Streamlit dashboard
-    r = pdk.Deck(
-        layers=geojson,
-        initial_view_state=initial_view_state,
-        map_provider='mapbox',
-        map_style=base_map_dict[base_map],
-        tooltip=tooltip
-    )
-
-    return r
-
-
-# function to display 3D map
-def mapper_3D():
-
-    # tabular data
-    df = filter_data_map()[1]
-    df['GEOID'] = df['GEOID'].astype(str)
-
-    # read in geospatial
-    gdf = gpd.read_file('Geography/Rockdale_CTs.gpkg')
-
-    # join together the 2, and let not man put asunder
-    joined_df = gdf.merge(df, left_on='GEOID', right_on='GEOID')
-
-    # ensure we're working with a geodataframe
-    joined_df = gpd.GeoDataFrame(joined_df)
-
-    # gonna be ugly as sin, but format the proper column
-    joined_df['var_formatted'] = joined_df[dash_variable_dict[dash_variable][0]].apply(
-        lambda x: dash_variable_dict[dash_variable][2].format((x)))
-
-    # create a 'label' column
-    joined_df['dashboard_var_label'] = dash_variable
-
-    # set choropleth color
-    joined_df['choro_color'] = pd.cut(
-        joined_df[dash_variable_dict[dash_variable][0]],
-        bins=len(custom_colors),
-        labels=custom_colors,
-        include_lowest=True,
-        duplicates='drop'
-    )
-
-    # create map intitial state
-    initial_view_state = pdk.ViewState(
-        latitude=latitude_3D,
-        longitude=longitude_3D,
-        zoom=zoom_3D,
-        max_zoom=max_zoom,
-        min_zoom=min_zoom,
-        pitch=45,
-        bearing=0,
-        height=map_height
-    )
-
-    # create geojson layer
-    geojson = pdk.Layer(
-        "GeoJsonLayer",
-        joined_df,
-        pickable=True,
-        autoHighlight=True,
-        highlight_color=[255, 255, 255, 90],
-        opacity=0.5,
-        stroked=False,
-        filled=True,
-        wireframe=False,
-        extruded=True,
-        get_elevation='yr_built * 25',
-        get_fill_color='choro_color',
-        get_line_color='choro_color',
-        line_width_min_pixels=1
-    )
-
-    tooltip = {
-        "html": "Median {dashboard_var_label}: <b>{var_formatted}</b><br>Total sales: <b>{yr_built}</b><hr style='margin: 10px auto; opacity:0.5; border-top: 2px solid white; width:85%'>\
-                    Census Tract {GEOID} <br>\
-                    {Sub_geo}",
-        "style": {"background": "rgba(2,43,58,0.7)",
-                  "border": "1px solid white",
-                  "color": "white",
-                  "font-family": "Helvetica",
-                  "text-align": "center"
-                  },
-    }
-
-    r = pdk.Deck(
-        layers=geojson,
-        initial_view_state=initial_view_state,
-        map_provider='mapbox',
-        map_style=base_map_dict[base_map],
-        tooltip=tooltip)
-
-    return r
-
-
-# filter the data for the line chart
+# the monthly series for the line chart, plus its rolling average & the repeat-sales index if they're selected
 def filter_data_chart():
+    monthly = queries.chart_series(filter_state)
+    smoothed = queries.chart_series(filter_state, trend_window) if trend_window else None
+    repeat_index = county_data.repeat_sales.chart_series(filter_state) if show_repeat_sales else None
+    return monthly, smoothed, repeat_index
 
-    # read in dataframe
-    df = df_init
-
-    # get construction vintage lower / upper bounds
-    vintage_lower_bound = year_built_dict[year_built[0]][0]
-    vintage_upper_bound = year_built_dict[year_built[1]][1]
-
-    # Now apply filters based on transaction year, construction vintage, and sub-geography (if applicable)
-    if geography_included == 'City/Region':  # apply a sub-geography filter
-        filtered_df = df[
-            (df['yr_built'] >= vintage_lower_bound) &
-            (df['yr_built'] <= vintage_upper_bound) &
-            (df['Sub_geo'].isin(sub_geo))]
-    else:  # do not apply a sub-geography filter
-        filtered_df = df[
-            (df['yr_built'] >= vintage_lower_bound) &
-            (df['yr_built'] <= vintage_upper_bound)
-        ]
-
-    # now group by month so we get a longitudinal trend for each variable that is selected
-    grouped_df = filtered_df.groupby('year-month').agg({
-        # this first agg will read the dash variable and make the correct calculation
-        dash_variable_dict[dash_variable][0]: dash_variable_dict[dash_variable][1],
-        'month': pd.Series.mode,
-        'year': pd.Series.mode
-    }).reset_index()
-
-    return grouped_df
-
-
-# draw the line chart
-def plotly_charter():
-
-    # read in the filtered & grouped data
-    df = filter_data_chart()
-
-    # gonna be ugly as sin, but format the proper column
-    df['var_formatted'] = df[dash_variable_dict[dash_variable][0]].apply(
-        lambda x: dash_variable_dict[dash_variable][2].format((x)))
-
-    # create a 'label' column for the above variable
-    df['dashboard_var_label'] = df[dash_variable_dict[dash_variable][0]].apply(
-        lambda x: dash_variable_dict[dash_variable][3].format((x)))
-
-    # sort the data so that it's chronological
-    df = df.sort_values(['year', 'month'])
-
-    fig = px.line(
-        df,
-        x="year-month",
-        y=dash_variable_dict[dash_variable][0],
-    )
-
-    # modify the line itself
-    fig.update_traces(
-        mode="lines",
-        line_color='#022B3A',
-        hovertemplate="<br>".join([
-            "<b>%{y}</b>"
-        ])
-    )
 
-    # set chart title style variables
-    chart_title_font_size = '20'
-    chart_title_color = '#FFFFFF'
-    chart_title_font_weight = '650'
-
-    chart_subtitle_font_size = '14'
-    chart_subtitle_color = '#FFFFFF'
-    chart_subtitle_font_weight = '650'
-
-    if sub_geo == "":
-        chart_title_text = f"Countywide {dash_variable_dict[dash_variable][3].lower()}"
-    elif len(sub_geo) == 1:
-        chart_title_text = f"{sub_geo[0]} {dash_variable_dict[dash_variable][3].lower()}"
-    elif len(sub_geo) == 2:
-        chart_title_text = f"{sub_geo[0]} & {sub_geo[1]} {dash_variable_dict[dash_variable][3].lower()}"
-    else:
-        chart_title_text = f"{dash_variable_dict[dash_variable][3]} For Selected Regions"
-
-    # update the fig
-    fig.update_layout(
-        title_text=f'<span style="font-size:{chart_title_font_size}px; font-weight:{chart_title_font_weight}; color:{chart_title_color}">{chart_title_text}</span><br><span style="font-size:{chart_subtitle_font_size}px; font-weight:{chart_subtitle_font_weight}; color:{chart_subtitle_color}">(orange lines reflect range of selected years)</span>',
-        title_x=0,
-        title_y=0.93,
-        margin=dict(
-            t=85
-        ),
-        hoverlabel=dict(
-            bgcolor="rgba(255, 255, 255, 0.8)",
-            bordercolor="#022B3A",
-            font_size=16,  # set the font size of the chart tooltip
-            font_color="#022B3A",
-            align="left"
-        ),
-        yaxis=dict(
-            linecolor="#022B3A",
-            title=None,
-            tickfont_color='#022B3A',
-            tickfont_size=13,
-            tickformat=dash_variable_dict[dash_variable][4],
-            showgrid=False,
-            zeroline=False
-        ),
-        xaxis=dict(
-            linecolor="#022B3A",
-            linewidth=1,
-            tickfont_color='#022B3A',
-            title=None,
-            tickangle=90,
-            tickfont_size=13,
-            tickformat='%b %Y',
-            dtick='M6'
-        ),
-        height=450,
-        hovermode="x unified")
-
-    # add shifting vertical lines
-    year_start = {
-        2018: '2018-1',
-        2019: '2019-1',
-        2020: '2020-1',
-        2021: '2021-1',
-        2022: '2022-1',
-        2023: '2023-1'
-    }
-
-    year_end = {
-        2018: '2018-12',
-        2019: '2019-12',
-        2020: '2020-12',
-        2021: '2021-12',
-        2022: '2022-12',
-        2023: '2023-6'
-    }
-
-    fig.add_vline(x=year_start[years[0]], line_width=2,
-                  line_dash="dash", line_color="#FF8966")
-    fig.add_vline(x=year_end[years[1]], line_width=2,
-                  line_dash="dash", line_color="#FF8966")
-
-    return fig
+# Calculate, style KPIs-v-v-v-v-v-v-v-v-v-v-v-v-v
 
+# when the selection ends in a partial year, offer to compare the same months of both years
+ytd_window = ytd_months(queries.cube)
+like_for_like = False
+if ytd_comparable(queries.cube, years):
+    like_for_like = st.sidebar.checkbox(
+        'Compare year-to-date',
+        value=compare_ytd_default,
+        help=f'{years[1]} only has sales through {months_label(ytd_window).split("-")[1]}. Compare the same months ({months_label(ytd_window)}) of both years for the YoY change, instead of a partial year with a full one.'
+    )
 
-# Calculate, style KPIs-v-v-v-v-v-v-v-v-v-v-v-v-v
-kpi_df = filter_data_map()[0]
+# KPI values for the selected filters, shared with the map through the query layer
+with profile.stage('kpis', queries):
+    kpi_totals = queries.kpi_totals(filter_state)
+    kpi_changes = queries.kpi_changes(filter_state, like_for_like)
 
 # calculate & format all necessary KPI values from the filtered data
-median_vintage = '{:.0f}'.format(kpi_df['yr_built'].median())
-median_sf = '{:,.0f}'.format(kpi_df['square_feet'].median())
-total_sales = '{:,.0f}'.format(kpi_df.shape[0])
-median_price_sf = '${:.0f}'.format(kpi_df['price_sf'].median())
-median_price = '${:,.0f}'.format(kpi_df['sale_price'].median())
-
-
-# calculate variables from the filtered dataframe that will drive the YoY change KPIs
-df_firstYear = kpi_df[kpi_df['year'] == years[0]]
-df_secondYear = kpi_df[kpi_df['year'] == years[1]]
-delta_total_sales = '{:.1%}'.format((df_secondYear['price_sf'].count() -
-                                     df_firstYear['price_sf'].count()) / df_firstYear['price_sf'].count())
-delta_price_sf = '{:.1%}'.format((df_secondYear['price_sf'].median() -
-                                  df_firstYear['price_sf'].median()) / df_firstYear['price_sf'].median())
-delta_price = '{:.1%}'.format((df_secondYear['sale_price'].median() -
-                               df_firstYear['sale_price'].median()) / df_firstYear['sale_price'].median())
+median_vintage = '{:.0f}'.format(kpi_totals['median_vintage'])
+median_sf = '{:,.0f}'.format(kpi_totals['median_sf'])
+total_sales = '{:,.0f}'.format(kpi_totals['total_sales'])
+median_price_sf = '${:.0f}'.format(kpi_totals['median_price_sf'])
+median_price = '${:,.0f}'.format(kpi_totals['median_price'])
+
+
+# YoY change of every KPI between the first & last selected years, looked up from the cached change table.
+# A change from a year without sales shows as n/a
+delta_total_sales, delta_price_sf, delta_price = [
+    format_change(lookup_change(kpi_changes, years[0], years[1], kpi))
+    for kpi in ('total_sales', 'median_price_sf', 'median_price')
+]
+change_label = f'{years[0]} to {years[1]} change'
+if like_for_like:
+    change_label += f' ({months_label(ytd_window)})'
 
 # dictionary to pick out which KPI metrics to show
 KPI_dict = {
@@ -653,7 +338,7 @@ with col3:
     # secondary metric - YoY change of dashboard variable, if applicable
     if years[0] != years[1]:
         subcol2.markdown(
-            f"<span style='color:{KPI_label_font_color}; font-size:{KPI_label_font_size}px; font-weight:{KPI_label_font_weight}'>{years[0]} to {years[1]} change</span><br><span style='color:{KPI_value_font_color}; font-size:{KPI_value_font_size}px; font-weight:{KPI_value_font_weight}; line-height: {KPI_line_height}px'>{KPI_dict[dash_variable][1]}</span>", unsafe_allow_html=True)
+            f"<span style='color:{KPI_label_font_color}; font-size:{KPI_label_font_size}px; font-weight:{KPI_label_font_weight}'>{change_label}</span><br><span style='color:{KPI_value_font_color}; font-size:{KPI_value_font_size}px; font-weight:{KPI_value_font_weight}; line-height: {KPI_line_height}px'>{KPI_dict[dash_variable][1]}</span>", unsafe_allow_html=True)
     else:
         subcol2.markdown(
             f"<span style='color:{KPI_label_font_color}; font-size:{KPI_label_font_size}px; font-weight:{KPI_label_font_weight}'>No year over year change<br>for single year selection.</span>", unsafe_allow_html=True)
@@ -667,28 +352,78 @@ with col3:
     # put a vertical spacer between the KPIs and the plotly line chart
     subcol2.write("")
 
+# map data & choropleth class breaks for the selected filters
+with profile.stage('filter_data_map', queries):
+    if map_layer == 'Hexagons':
+        map_df = county_data.hexbins.map_frame(hex_size, filter_state)
+        map_breaks = choropleth_classes(county_data.hexbins.queries[hex_size], map_df, dash_variable)
+    else:
+        map_df = filter_data_map()
+        map_breaks = choropleth_classes(queries, map_df, dash_variable)
+
+with profile.stage('filter_data_chart', queries):
+    chart_series, chart_smoothed, chart_index = filter_data_chart()
+
+with profile.stage('load_geo_data'):
+    geometry = load_geo_data()
+
+# the individual sales within the filters, as compact point records
+map_points = None
+if show_parcels:
+    with profile.stage('parcel_points'):
+        map_points = county_data.parcels.layer_data(filter_state, point_colors)
+
+# build the map & chart figures, then render them below (rendering is where they're serialized)
+with profile.stage('plotly_charter'):
+    chart_fig = plotly_charter(chart_series, dash_variable, years, sub_geo, chart_smoothed, trend_window,
+                               chart_index)
+
+with profile.stage('mapper'):
+    if map_layer == 'Hexagons':
+        map_deck = mapper_hex(map_df, hex_size, map_breaks, dash_variable, base_map,
+                              county_settings['view_2D'], extruded=map_view == '3D', points=map_points)
+    elif map_view == '2D':
+        map_deck = mapper_2D(map_df, geometry, map_breaks, dash_variable, base_map,
+                             county_settings['view_2D'], points=map_points)
+    else:
+        map_deck = mapper_3D(map_df, geometry, map_breaks, dash_variable, base_map,
+                             county_settings['view_3D'], points=map_points)
+
 # logic to draw the map & chart based on 2D / 3D selection
 if map_view == '2D':
-    col3.plotly_chart(plotly_charter(), use_container_width=True,
-                      config={'displayModeBar': False})
-    col1.pydeck_chart(mapper_2D(), use_container_width=True)
+    with profile.stage('render_chart'):
+        col3.plotly_chart(chart_fig, use_container_width=True,
+                          config={'displayModeBar': False})
+    with profile.stage('render_map'):
+        col1.pydeck_chart(map_deck, use_container_width=True)
     with col1:
         expander = st.expander("Notes")
         expander.markdown(
-            f"<span style='color:#022B3A'> Darker shades of Census tracts represent higher sales prices per SF for the selected time period. Dashboard excludes non-qualified, non-market, and bulk transactions. Excludes transactions below $1,000 and homes smaller than 75 square feet. Data downloaded from {county_var} County public records on September 15, 2023.</span>", unsafe_allow_html=True)
+            f"<span style='color:#022B3A'> Darker shades of Census tracts represent higher sales prices per SF for the selected time period. Dashboard excludes non-qualified, non-market, and bulk transactions. Excludes transactions below $1,000 and homes smaller than 75 square feet. Data downloaded from {county_var} County public records on {county_settings['data_date']}.</span>", unsafe_allow_html=True)
 else:
-    col1.pydeck_chart(mapper_3D(), use_container_width=True)
+    with profile.stage('render_map'):
+        col1.pydeck_chart(map_deck, use_container_width=True)
     with col1:
         col1.markdown("<span style='color:#022B3A'><b>Shift + click</b> in 3D view to rotate and change map angle. Census tract 'height' represents total sales. Darker colors represent higher median home sale prices.</span>", unsafe_allow_html=True)
         expander = st.expander("Notes")
         expander.markdown(
-            f"<span style='color:#022B3A'>Census tract 'height' representative of total sales per tract. Darker shades of Census tracts represent higher sales prices per SF for the selected time period. Dashboard excludes non-qualified, non-market, and bulk transactions. Excludes transactions below $1,000 and homes smaller than 75 square feet. Data downloaded from {county_var} County public records on September 15, 2023.</span>", unsafe_allow_html=True)
-    col3.plotly_chart(plotly_charter(), use_container_width=True,
-                      config={'displayModeBar': False})
+            f"<span style='color:#022B3A'>Census tract 'height' representative of total sales per tract. Darker shades of Census tracts represent higher sales prices per SF for the selected time period. Dashboard excludes non-qualified, non-market, and bulk transactions. Excludes transactions below $1,000 and homes smaller than 75 square feet. Data downloaded from {county_var} County public records on {county_settings['data_date']}.</span>", unsafe_allow_html=True)
+    with profile.stage('render_chart'):
+        col3.plotly_chart(chart_fig, use_container_width=True,
+                          config={'displayModeBar': False})
 
 # draw logo at lower-right corner of dashboard
-im = Image.open('Content/logo.png')
+im = load_logo()
 with col3:
     subcol1, subcol2, subcol3, subcol4 = st.columns([1, 1, 1, 1])
     subcol3.write("Powered by:")
     subcol4.image(im, width=80)
+
+
+# log this rerun's timings &, when profiling, show them in a debug panel at the bottom of the sidebar
+rerun_record = profile.finish()
+if rerun_record is not None:
+    with st.sidebar.expander('Debug: rerun timings'):
+        st.write(f"Total: {rerun_record['total_ms']:,.1f} ms")
+        st.dataframe(rerun_record['stages'], use_container_width=True)
+        st.dataframe(rerun_record['cache'], use_container_width=True)
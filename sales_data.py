@@ -0,0 +1,101 @@
+import os
+import sys
+
+import pandas as pd
+import pyarrow.feather as feather
+
+# the geocoded & tract-joined sales exported from the geocoding step
+csv_path = 'Geocode/RockdaleJoined_18-23.csv'
+
+# the typed, columnar copy of the same sales written by the build step below
+feather_path = 'Geocode/RockdaleJoined_18-23.feather'
+
+# compact dtypes for every column kept in the columnar file
+sales_schema = {
+    'Parcel ID': 'category',
+    'sale_date': 'string',
+    'year': 'int16',
+    'month': 'int16',
+    'year-month': 'category',
+    'sale_price': 'int32',
+    'yr_built': 'int16',
+    'square_feet': 'int32',
+    'price_sf': 'float32',
+    'lat': 'float64',
+    'long': 'float64',
+    'GEOID': 'category',
+    'Sub_geo': 'category'
+}
+
+# the columns the dashboard itself reads
+dashboard_columns = [
+    'year',
+    'month',
+    'year-month',
+    'sale_price',
+    'yr_built',
+    'square_feet',
+    'price_sf',
+    'GEOID',
+    'Sub_geo'
+]
+
+
+# parse the raw CSV & cast it to the compact schema
+def read_sales_csv(path=csv_path):
+    df = pd.read_csv(
+        path,
+        thousands=',',
+        keep_default_na=False
+    )
+
+    # drop Unnamed column, if it exists, along with the address & the WKT geometry (lat / long cover it)
+    df = df.loc[:, ~df.columns.str.startswith('Unnamed')]
+    df = df.drop(['Address', 'geometry'], axis=1, errors='ignore')
+
+    return df.astype({col: dtype for col, dtype in sales_schema.items() if col in df.columns})
+
+
+# build step: write the typed sales to an uncompressed Feather (Arrow IPC) file, so it can be memory-mapped
+def build_sales_feather(src=csv_path, dst=feather_path):
+    df = read_sales_csv(src)
+    feather.write_feather(df, dst, compression='uncompressed')
+    return df
+
+
+# load the sales, reading only the requested columns. Uses the Feather file when it's at least as new as
+# the CSV, & falls back to parsing the CSV otherwise. Memory-mapping the file means only the requested
+# columns are read from disk, but converting them to pandas still copies them into the DataFrame
+def load_sales(columns=None, src=csv_path, path=feather_path):
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(src):
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        return table.to_pandas()
+
+    df = read_sales_csv(src)
+
+    if columns is not None:
+        df = df[columns]
+
+    return df
+
+
+# read one partition of newly published sales (Feather, Parquet or CSV) into the same schema
+def read_partition(path, columns=None):
+    if path.endswith('.feather'):
+        df = feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    elif path.endswith('.parquet'):
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = read_sales_csv(path)
+        if columns is not None:
+            df = df[columns]
+
+    return df.astype({col: dtype for col, dtype in sales_schema.items() if col in df.columns})
+
+
+if __name__ == '__main__':
+    src = sys.argv[1] if len(sys.argv) > 1 else csv_path
+    dst = sys.argv[2] if len(sys.argv) > 2 else feather_path
+
+    df = build_sales_feather(src, dst)
+    print(f'wrote {len(df):,} sales to {dst}')
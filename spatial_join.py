@@ -0,0 +1,109 @@
+import argparse
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from tract_geometry import tract_path
+
+# the geocoded sales, the tract -> sub-geography table & the joined output the dashboard reads
+geocoded_path = 'Geocode/Rockdale_geocoded.csv'
+sub_geo_path = 'Geography/Rockdale_subgeos.csv'
+joined_path = 'Geocode/RockdaleJoined_18-23.csv'
+
+# columns of the joined output, in the order the dashboard's CSV has them
+joined_columns = [
+    'Parcel ID',
+    'Address',
+    'sale_date',
+    'year',
+    'month',
+    'year-month',
+    'sale_price',
+    'yr_built',
+    'square_feet',
+    'price_sf',
+    'lat',
+    'long',
+    'GEOID',
+    'Sub_geo',
+    'geometry'
+]
+
+# projected CRS used for the join, so the boundary tolerance is in meters (UTM zone 16N covers the metro region)
+join_crs = 'EPSG:32616'
+
+
+# first tree index for every input index in a (input, tree) pair array, preferring the lowest tree
+# index when a point matches more than one tract (e.g. sitting right on a shared boundary)
+def first_match(pairs, n):
+    match = np.full(n, -1)
+    if pairs.shape[1]:
+        order = np.lexsort((pairs[1], pairs[0]))
+        inputs, first = np.unique(pairs[0][order], return_index=True)
+        match[inputs] = pairs[1][order][first]
+    return match
+
+
+class TractIndex:
+
+    # build an STRtree over the tract polygons
+    def __init__(self, tracts, crs=join_crs):
+        tracts = tracts.to_crs(crs)
+        self.crs = crs
+        self.geoids = tracts['GEOID'].astype(str).to_numpy()
+        self.tree = shapely.STRtree(tracts.geometry.to_numpy())
+
+    # assign a GEOID to every point in one vectorized pass. Points outside every tract, but within
+    # `tolerance` meters of one, go to the nearest tract; the rest get None
+    def assign(self, lon, lat, tolerance=0):
+        points = gpd.GeoSeries.from_xy(lon, lat, crs='EPSG:4326').to_crs(self.crs).to_numpy()
+
+        match = first_match(self.tree.query(points, predicate='intersects'), len(points))
+
+        # snap the points that just miss a tract, e.g. a geocode on the wrong side of a county line
+        missing = np.flatnonzero(match < 0)
+        if tolerance > 0 and len(missing):
+            nearest = self.tree.query_nearest(points[missing], max_distance=tolerance)
+            match[missing] = first_match(nearest, len(missing))
+
+        return np.where(match >= 0, self.geoids[match], None)
+
+
+# stream the geocoded sales through the tract index in chunks & append each joined chunk to the output,
+# so memory stays bounded by the chunk size regardless of how many sales there are
+def join_sales(src=geocoded_path, dst=joined_path, tracts=tract_path, sub_geos=sub_geo_path,
+               tolerance=0, chunksize=100_000):
+    index = TractIndex(gpd.read_file(tracts))
+    sub_geo_lookup = pd.read_csv(sub_geos, dtype=str).set_index('GEOID')['Sub_geo']
+
+    total = 0
+    for i, chunk in enumerate(pd.read_csv(src, index_col=0, chunksize=chunksize)):
+        chunk['GEOID'] = index.assign(chunk['long'].to_numpy(), chunk['lat'].to_numpy(), tolerance)
+
+        # drop the sales that fall outside of every tract, like an inner join would
+        chunk = chunk[chunk['GEOID'].notna()].copy()
+        chunk['Sub_geo'] = chunk['GEOID'].map(sub_geo_lookup).fillna('')
+        chunk['geometry'] = 'POINT (' + chunk['long'].astype(str) + ' ' + chunk['lat'].astype(str) + ')'
+
+        chunk[joined_columns].to_csv(dst, mode='w' if i == 0 else 'a', header=i == 0)
+        total += len(chunk)
+
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Join geocoded sales to the Census tracts they fall in.')
+    parser.add_argument('--src', default=geocoded_path, help='geocoded sales CSV')
+    parser.add_argument('--dst', default=joined_path, help='joined output CSV')
+    parser.add_argument('--tracts', default=tract_path, help='tract polygons with a GEOID column')
+    parser.add_argument('--sub-geos', default=sub_geo_path, help='GEOID -> Sub_geo CSV')
+    parser.add_argument('--tolerance', type=float, default=0,
+                        help='snap points within this many meters of a tract boundary')
+    parser.add_argument('--chunksize', type=int, default=100_000, help='sales per chunk')
+    args = parser.parse_args()
+
+    total = join_sales(args.src, args.dst, args.tracts, args.sub_geos, args.tolerance, args.chunksize)
+    print(f'joined {total:,} sales to {args.dst}')
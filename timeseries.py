@@ -0,0 +1,78 @@
+import threading
+from itertools import combinations_with_replacement
+
+import numpy as np
+import pandas as pd
+
+from dash_config import dash_variable_dict, year_built_dict
+
+# rolling windows (in months) offered for smoothing the trend chart
+rolling_windows = [3, 6, 12]
+
+
+class MonthlyStore:
+
+    # the trend chart's monthly series, held as numeric arrays over one monthly PeriodIndex that runs from
+    # the cube's first month to its last. Months without sales are 0 for counts & NaN for medians. The
+    # county-wide & single sub-geography series for every vintage range are built up front, & any other
+    # slice (several sub-geographies) is built on first use & kept
+    def __init__(self, cube, precompute=True):
+        self.cube = cube
+
+        periods = cube.month_lookup['period']
+        self.index = pd.period_range(periods.min(), periods.max(), freq='M')
+
+        # position of every year-month key within the index
+        start = self.index[0]
+        self.positions = (cube.month_lookup['year'].astype(int) * 12 + cube.month_lookup['month'].astype(int)
+                          - (start.year * 12 + start.month))
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+        if precompute:
+            vintages = list(year_built_dict)
+            sub_geos = [None] + [(sub_geo,) for sub_geo in sorted(cube.geoid_lookup['Sub_geo'].unique())]
+            for first, last in combinations_with_replacement(range(len(vintages)), 2):
+                for sub_geo in sub_geos:
+                    self._build((vintages[first], vintages[last]), sub_geo)
+
+    # roll up every dash variable by month for one slice, in one pass over its cells
+    def _build(self, year_built, sub_geo):
+        aggs = {dash_variable: tuple(settings[:2]) for dash_variable, settings in dash_variable_dict.items()}
+        grouped_df = self.cube.rollup(self.cube.select(year_built=year_built, sub_geo=sub_geo), 'year-month', aggs)
+        positions = self.positions.reindex(grouped_df.index).to_numpy()
+
+        built = {}
+        for dash_variable, (column, how) in aggs.items():
+            values = np.full(len(self.index), 0.0 if how == 'count' else np.nan)
+            values[positions] = grouped_df[dash_variable].to_numpy(dtype='float64')
+            built[(year_built, sub_geo, dash_variable, None)] = values
+
+        with self._lock:
+            self._series.update(built)
+
+    # the monthly values of the dash variable for the vintage & sub-geography filters, or their trailing
+    # average over the given number of months (counting the months present, so gaps & the first months
+    # still have a value)
+    def series(self, year_built, sub_geo, dash_variable, window=None):
+        key = (year_built, sub_geo, dash_variable, window)
+        if key not in self._series:
+            if window is None:
+                self._build(year_built, sub_geo)
+            else:
+                monthly = pd.Series(self.series(year_built, sub_geo, dash_variable))
+                values = monthly.rolling(window, min_periods=1).mean().to_numpy()
+                with self._lock:
+                    self._series[key] = values
+
+        return self._series[key]
+
+    # every monthly series built so far (not the rolling averages), as (year_built, sub_geo, dash_variable, values)
+    def monthly_series(self):
+        with self._lock:
+            return [key[:3] + (values,) for key, values in self._series.items() if key[3] is None]
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self._series.values())
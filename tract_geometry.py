@@ -0,0 +1,139 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+# census tract geometry for the county
+tract_path = 'Geography/Rockdale_CTs.gpkg'
+
+# simplification tolerances (in meters) of the tract geometry's levels of detail, from finest to coarsest.
+# 0 keeps the full-resolution polygons, with only their coordinates quantized
+lod_tolerances = [0, 5, 20, 80]
+
+# the largest simplification error allowed on screen, in pixels
+lod_pixel_tolerance = 0.5
+
+# zoom levels the map can be zoomed in by before the simplification may show. Streamlit doesn't report the
+# map's viewport back to the app, so the level is picked from the initial view
+lod_zoom_headroom = 1
+
+
+# read the tracts, reproject them to WGS84 & pre-serialize each one into a GeoJSON geometry keyed by GEOID.
+# geopandas is only needed here, so it's imported when a county is first loaded rather than at startup
+def load_tract_geometry(path=tract_path):
+    import geopandas as gpd
+
+    gdf = gpd.read_file(path)[['GEOID', 'geometry']].to_crs(epsg=4326)
+    gdf['GEOID'] = gdf['GEOID'].astype(str)
+
+    features = json.loads(gdf.to_json(drop_id=True))['features']
+
+    return {feature['properties']['GEOID']: feature['geometry'] for feature in features}
+
+
+# the levels of detail built from the tracts, saved next to them (e.g. Rockdale_CTs.lod.json)
+def lod_path(path=tract_path):
+    return os.path.splitext(path)[0] + '.lod.json'
+
+
+# decimal places kept for a level's coordinates: about a tenth of its tolerance, & at most 6 (~0.1 m)
+def lod_decimals(tolerance):
+    if tolerance <= 0:
+        return 6
+    return int(np.clip(np.ceil(-np.log10(tolerance / 10 / 111320)), 4, 6))
+
+
+# round every coordinate of a GeoJSON geometry & drop the repeated points that rounding leaves behind
+def quantize_geometry(geometry, decimals):
+    def ring(coords):
+        coords = np.round(np.asarray(coords, dtype='float64'), decimals)
+        keep = np.ones(len(coords), dtype=bool)
+        keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+        return coords[keep].tolist()
+
+    if geometry['type'] == 'Polygon':
+        return {'type': 'Polygon', 'coordinates': [ring(r) for r in geometry['coordinates']]}
+    return {'type': 'MultiPolygon', 'coordinates': [[ring(r) for r in polygon] for polygon in geometry['coordinates']]}
+
+
+# simplify the tracts at every tolerance, keeping the boundaries neighboring tracts share identical so no
+# gaps or overlaps open up between them. Returns [(tolerance, {GEOID: GeoJSON geometry})], finest first
+def build_tract_levels(path=tract_path, tolerances=lod_tolerances):
+    import geopandas as gpd
+    import shapely
+
+    gdf = gpd.read_file(path)[['GEOID', 'geometry']]
+    gdf['GEOID'] = gdf['GEOID'].astype(str)
+
+    # simplify in meters, in the tracts' UTM zone
+    projected = gdf.to_crs(gdf.estimate_utm_crs())
+
+    levels = []
+    for tolerance in tolerances:
+        geometry = projected.geometry
+        if tolerance > 0:
+            # coverage simplification (shapely 2.1+) simplifies each shared edge once for both tracts.
+            # Older versions simplify every tract on its own, which can leave slivers along shared edges
+            if hasattr(shapely, 'coverage_simplify'):
+                geometry = gpd.GeoSeries(shapely.coverage_simplify(geometry.values, tolerance),
+                                         index=geometry.index, crs=geometry.crs)
+            else:
+                geometry = geometry.simplify(tolerance, preserve_topology=True)
+
+        features = json.loads(gdf.set_geometry(geometry.to_crs(epsg=4326)).to_json(drop_id=True))['features']
+        levels.append((tolerance, {
+            feature['properties']['GEOID']: quantize_geometry(feature['geometry'], lod_decimals(tolerance))
+            for feature in features
+        }))
+
+    return levels
+
+
+# write the levels of detail for the tracts, for the dashboard to load instead of the full geometry
+def write_tract_levels(path=tract_path, dst=None, tolerances=lod_tolerances):
+    dst = dst or lod_path(path)
+    levels = build_tract_levels(path, tolerances)
+
+    with open(dst, 'w') as f:
+        json.dump({'levels': [{'tolerance': tolerance, 'geometry': geometry} for tolerance, geometry in levels]},
+                  f, separators=(',', ':'))
+
+    return levels
+
+
+# the tract levels of detail, read from the build step's file when it's newer than the tracts, or built
+# in memory otherwise
+def load_tract_levels(path=tract_path):
+    levels_path = lod_path(path)
+    if os.path.exists(levels_path) and os.path.getmtime(levels_path) >= os.path.getmtime(path):
+        with open(levels_path) as f:
+            return [(level['tolerance'], level['geometry']) for level in json.load(f)['levels']]
+
+    return build_tract_levels(path)
+
+
+# the coarsest level whose simplification stays under the pixel tolerance at the view's zoom level
+# (view is {'latitude', 'longitude', 'zoom'})
+def level_for_view(levels, view, pixel_tolerance=lod_pixel_tolerance, headroom=lod_zoom_headroom):
+    meters_per_pixel = 156543.03 * np.cos(np.radians(view['latitude'])) / 2 ** (view['zoom'] + headroom)
+    fine_enough = [level for level in levels if level[0] <= meters_per_pixel * pixel_tolerance]
+    return max(fine_enough or levels[:1], key=lambda level: level[0])[1]
+
+
+# attach the static geometry to a small per-tract attribute table (value, color, label), ready for pydeck
+def tract_layer_data(geometry, df):
+    records = df.to_dict(orient='records')
+
+    # keep only the tracts that have geometry, like an inner join would
+    return [dict(record, geometry=geometry[record['GEOID']])
+            for record in records if record['GEOID'] in geometry]
+
+
+if __name__ == '__main__':
+    src = sys.argv[1] if len(sys.argv) > 1 else tract_path
+    dst = sys.argv[2] if len(sys.argv) > 2 else lod_path(src)
+
+    for tolerance, geometry in write_tract_levels(src, dst):
+        print(f'{tolerance} m: {len(json.dumps(geometry, separators=(",", ":"))) / 1e3:,.0f} KB')
+    print(f'wrote the levels of detail to {dst}')